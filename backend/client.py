@@ -7,100 +7,2184 @@ Privde CRUD methods to manipulate content feeds.
 
 # system library
 import base64
+import collections
+import cPickle as pickle
+import hashlib
 import httplib
+import multiprocessing
+import os
+import Queue
+import random
 import re
+import socket
 import sys
+import tempfile
+import threading
+import time
+import zlib
 sys.path.append('..')
 
 # Crouke library
 from objectifyxml import ContentParser
+from objectifyxml import DigestChunks
+from objectifyxml import EntryStream
+from objectifyxml import ParseMemo
+from objectifyxml import __BASE__
 import excepts
 
 pattern = re.compile(r'/V1/(\w+)/(.*?)')
 
+# Connection pool defaults. Each api server gets at most _POOL_SIZE open
+# connections and an idle connection older than _POOL_IDLE_TIMEOUT seconds
+# is closed rather than reused.
+_POOL_SIZE = 4
+_POOL_IDLE_TIMEOUT = 60
+_SOCKET_TIMEOUT = 30
+
+# Default size of the MemoryTier and seconds the MemoryTier and DiskTier
+# keep a feed for.
+_MEMORY_TIER_SIZE = 256
+_TIER_TTL = 300
+
+# Feed categories whose requests have side effects on the server, so their
+# results are never kept by the tiers or the HTTPCache.
+_UNCACHED_CATEGORIES = ('VOTE',)
+
+# Seconds the address of a host is cached for.
+_DNS_TTL = 300
+
+# Response bodies are read and parsed in chunks of this many bytes.
+_CHUNK_SIZE = 16384
+_ACCEPT_ENCODING = 'gzip, deflate'
+
+# How many connections DefaultCRUDHandler.GetMany pipelines a batch over.
+_PIPELINE_CONNECTIONS = 2
+
+# Errors raised by httplib when a kept-alive socket was closed by the server.
+_STALE_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest,
+                 httplib.ResponseNotReady, socket.error)
+
+# How many parsed feeds the HTTPCache keeps in memory to answer 304s.
+_HTTP_CACHE_PARSED = 64
+
+# What Prune leaves on disk: the HTTPCache entries stored in the last
+# _HTTP_CACHE_MAX_AGE seconds, within _HTTP_CACHE_MAX_BYTES, and the
+# DiskTier feeds within their ttl and _DISK_TIER_MAX_BYTES.
+_HTTP_CACHE_MAX_AGE = 30 * 86400
+_HTTP_CACHE_MAX_BYTES = 64 << 20
+_DISK_TIER_MAX_BYTES = 32 << 20
+
+# Body bytes of the feeds whose parse results are memoized by digest.
+_PARSE_MEMO_BYTES = 8 << 20
+
+# Default in-flight caps of the ConcurrentCRUDHandler.
+_MAX_PER_HOST = _POOL_SIZE
+_MAX_IN_FLIGHT = 32
+
+# RequestPolicy defaults. Backoff is in seconds. Hedging only starts once
+# _HEDGE_MIN_SAMPLES latencies out of the last _LATENCY_SAMPLES are known.
+_RETRIES = 2
+_BACKOFF = 0.5
+_MAX_BACKOFF = 8.0
+_LATENCY_SAMPLES = 200
+_HEDGE_MIN_SAMPLES = 20
+
+# HostScheduler defaults. Every host starts at _RATE requests per second
+# with one request in flight, and is then paced up to _MAX_RATE and
+# _POOL_SIZE requests in flight while it keeps answering within
+# _LATENCY_TARGET seconds. A Retry-After pauses the host for at most
+# _MAX_RETRY_AFTER seconds, and a request gives up waiting for its turn
+# after _ACQUIRE_TIMEOUT seconds.
+_RATE = 8.0
+_MIN_RATE = 0.5
+_MAX_RATE = 50.0
+_RATE_STEP = 1.0
+_LATENCY_TARGET = 2.0
+_MAX_RETRY_AFTER = 120
+_ACQUIRE_TIMEOUT = _SOCKET_TIMEOUT
+
+_pools = {}
+_pools_lock = threading.Lock()
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
 
 def GetCategoryType(url):
     """Retrieve the string reprsenting the feed category type.
 
     Args:
-        url: a url string that used to retrieve the content feed.
+        url: a url string that used to retrieve the content feed.
+
+    Returns:
+        A string reprsenting the feed category type.
+    """
+    m = pattern.match(url)
+    return m.groups()[0]
+
+
+def GetElementTagFromData(data):
+    """Return the xml tag names in an element.
+
+    Args:
+        data: an xml element.
+
+    Returns:
+        A list of tag names for a given element.
+    """
+    return [i.tag for i in data.GetElementData().getiterator()][1:]
+
+
+class _Flight(object):
+    """A request in flight and the callers waiting for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls made for the same key into one call.
+
+    The first caller for a key runs the call. Everyone asking for the same
+    key while it is running waits and gets the same result, or the same
+    error.
+    """
+
+    def __init__(self):
+        """Constructor to init the object."""
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._calls = 0
+        self._hits = 0
+        self._merged = 0
+
+    def Do(self, key, func, *args, **kws):
+        """Call func unless a call for key is already running.
+
+        Args:
+            key: a hashable key identifying the call.
+            func: the callable.
+            args: args passed to func.
+            kws: keyword args passed to func.
+
+        Returns:
+            What func returns.
+        """
+        self._lock.acquire()
+        self._calls += 1
+        flight = self._flights.get(key)
+        if flight:
+            self._hits += 1
+            flight.waiters += 1
+            if flight.waiters == 1:
+                self._merged += 1
+            self._lock.release()
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.result
+        flight = self._flights[key] = _Flight()
+        self._lock.release()
+
+        try:
+            try:
+                flight.result = func(*args, **kws)
+            except Exception, e:
+                flight.error = e
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._flights[key]
+            finally:
+                self._lock.release()
+            flight.done.set()
+        return flight.result
+
+    def GetStats(self):
+        """Return the coalescing counters.
+
+        Returns:
+            A dict with keys:
+                calls: how many calls were made.
+                hits: calls answered by a call some other caller made.
+                merged: calls that answered more than one caller.
+        """
+        self._lock.acquire()
+        try:
+            return {'calls': self._calls, 'hits': self._hits,
+                    'merged': self._merged}
+        finally:
+            self._lock.release()
+
+
+_flights = SingleFlight()
+
+
+def GetCoalescingStats():
+    """Return the counters of the requests coalesced by the handlers.
+
+    See SingleFlight.GetStats.
+    """
+    return _flights.GetStats()
+
+
+_parse_memo = ParseMemo(_PARSE_MEMO_BYTES)
+
+
+def GetParseMemoStats():
+    """Return the counters of the parse results memoized by body digest.
+
+    See objectifyxml.ParseMemo.GetStats.
+    """
+    return _parse_memo.GetStats()
+
+
+class Resolver(object):
+    """A DNS cache keeping the addresses of a host for a while.
+
+    Thread-safe.
+    """
+
+    def __init__(self, ttl=_DNS_TTL):
+        """Constructor to init the object.
+
+        Args:
+            ttl: seconds a resolved address is kept.
+        """
+        self._ttl = ttl
+        # (host, port) -> (expiry time, getaddrinfo result)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def Resolve(self, host, port):
+        """Return the addresses of a host.
+
+        Args:
+            host: the host name.
+            port: the port number.
+
+        Returns:
+            A list of getaddrinfo tuples for TCP connections.
+
+        Raises:
+            socket.error: when the host can not be resolved.
+        """
+        key = (host, port)
+        self._lock.acquire()
+        try:
+            entry = self._cache.get(key)
+        finally:
+            self._lock.release()
+        if entry and entry[0] > time.time():
+            return entry[1]
+        addrs = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        self._lock.acquire()
+        try:
+            self._cache[key] = (time.time() + self._ttl, addrs)
+        finally:
+            self._lock.release()
+        return addrs
+
+    def Forget(self, host, port):
+        """Drop the cached addresses of a host."""
+        self._lock.acquire()
+        try:
+            self._cache.pop((host, port), None)
+        finally:
+            self._lock.release()
+
+
+_resolver = Resolver()
+
+
+class _CachedDNSConnection(httplib.HTTPConnection):
+    """A HTTPConnection looking its host up through the shared Resolver."""
+
+    def connect(self):
+        """Connect to the first address of the host that accepts."""
+        error = socket.error('no address found for %s' % self.host)
+        for family, socktype, proto, name, addr in _resolver.Resolve(
+                self.host, self.port):
+            sock = socket.socket(family, socktype, proto)
+            try:
+                if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(self.timeout)
+                sock.connect(addr)
+            except socket.error, e:
+                sock.close()
+                error = e
+            else:
+                self.sock = sock
+                return
+        # the host may have moved, look it up again next time.
+        _resolver.Forget(self.host, self.port)
+        raise error
+
+
+class ConnectionPool(object):
+    """A bounded pool of persistent HTTP connections to one server.
+
+    Thread-safe. Connections are handed out by Acquire and must be given
+    back by either Release (the connection can be reused) or Discard.
+    """
+
+    def __init__(self, server, size=_POOL_SIZE,
+                 idle_timeout=_POOL_IDLE_TIMEOUT, timeout=_SOCKET_TIMEOUT):
+        """Constructor to init the object.
+
+        Args:
+            server: the target server.
+            size: the maximum number of connections open at the same time.
+            idle_timeout: seconds an idle connection may be kept for reuse.
+            timeout: the socket timeout of each connection.
+        """
+        self._server = server
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._timeout = timeout
+        # a stack of (connection, last used time) tuples.
+        self._idle = []
+        self._busy = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _NewConnection(self):
+        """Return a new, not yet connected, connection to the server."""
+        return _CachedDNSConnection(self._server, timeout=self._timeout)
+
+    def _Expire(self, now):
+        """Close the idle connections that are kept for too long.
+
+        Must be called with the pool lock held.
+        """
+        alive = []
+        for conn, used in self._idle:
+            if now - used > self._idle_timeout:
+                conn.close()
+            else:
+                alive.append((conn, used))
+        self._idle = alive
+
+    def Acquire(self):
+        """Get a connection, blocking while the pool is exhausted.
+
+        Returns:
+            A tuple of (connection, reused). reused is True when the
+            connection was used before and so might have gone stale.
+        """
+        self._cond.acquire()
+        try:
+            while True:
+                self._Expire(time.time())
+                if self._idle:
+                    conn, used = self._idle.pop()
+                    self._busy += 1
+                    return conn, True
+                if self._busy < self._size:
+                    self._busy += 1
+                    return self._NewConnection(), False
+                self._cond.wait()
+        finally:
+            self._cond.release()
+
+    def Release(self, conn):
+        """Give a connection back to the pool for reuse.
+
+        Args:
+            conn: a connection returned by Acquire whose last response
+                  has been read completely.
+        """
+        self._cond.acquire()
+        try:
+            self._busy -= 1
+            if len(self._idle) < self._size:
+                self._idle.append((conn, time.time()))
+            else:
+                conn.close()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def Discard(self, conn):
+        """Close a connection and drop it from the pool.
+
+        Args:
+            conn: a connection returned by Acquire.
+        """
+        conn.close()
+        self._cond.acquire()
+        try:
+            self._busy -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def Prime(self, count=1):
+        """Open connections ahead of time and keep them idle for reuse.
+
+        Args:
+            count: how many connections to open, within the pool size.
+        """
+        for i in range(count):
+            self._cond.acquire()
+            try:
+                if self._busy + len(self._idle) >= self._size:
+                    return
+                self._busy += 1
+            finally:
+                self._cond.release()
+            conn = self._NewConnection()
+            try:
+                conn.connect()
+            except socket.error:
+                self.Discard(conn)
+                return
+            self.Release(conn)
+
+    def Close(self):
+        """Close all the idle connections."""
+        self._cond.acquire()
+        try:
+            for conn, used in self._idle:
+                conn.close()
+            self._idle = []
+        finally:
+            self._cond.release()
+
+
+def GetConnectionPool(server):
+    """Return the connection pool shared by everyone talking to a server.
+
+    Args:
+        server: the target server.
+
+    Returns:
+        A ConnectionPool object.
+    """
+    _pools_lock.acquire()
+    try:
+        if server not in _pools:
+            _pools[server] = ConnectionPool(server)
+        return _pools[server]
+    finally:
+        _pools_lock.release()
+
+
+def WarmUp(servers, background=True):
+    """Resolve every server and open a connection to each ahead of time.
+
+    The servers are primed at the same time, so an unreachable one only
+    delays itself. A primed connection is only kept for _POOL_IDLE_TIMEOUT
+    seconds, so this pays off for the requests made soon after, e.g. at
+    startup; later requests open their connections as usual.
+
+    Args:
+        servers: a list of target servers.
+        background: boolean whether to do it on a background thread.
+
+    Returns:
+        The background thread, or None.
+    """
+    def Run():
+        workers = []
+        for server in servers:
+            worker = threading.Thread(target=GetConnectionPool(server).Prime)
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+    if not background:
+        Run()
+        return None
+    worker = threading.Thread(target=Run)
+    worker.setDaemon(True)
+    worker.start()
+    return worker
+
+
+def ClosePools():
+    """Close the idle connections of every connection pool."""
+    _pools_lock.acquire()
+    try:
+        for pool in _pools.itervalues():
+            pool.Close()
+    finally:
+        _pools_lock.release()
+
+
+class HostScheduler(object):
+    """Pace the requests sent to one host.
+
+    A token bucket limits the request rate and a window limits how many
+    requests are in flight. Both grow while the host answers quickly, and
+    are cut in half when it times out, answers with a 5xx status or slows
+    down past the latency target. Until the first cut they grow by a
+    quarter per request, afterwards only additively, so the scheduler
+    settles near the fastest pace the host puts up with.
+
+    Thread-safe.
+    """
+
+    def __init__(self, rate=_RATE, min_rate=_MIN_RATE, max_rate=_MAX_RATE,
+                 max_window=_POOL_SIZE, latency_target=_LATENCY_TARGET):
+        """Constructor to init the object.
+
+        Args:
+            rate: the initial requests per second.
+            min_rate: the lowest rate it backs off to.
+            max_rate: the highest rate it speeds up to.
+            max_window: the most requests it lets in flight.
+            latency_target: seconds a healthy response takes at most.
+        """
+        self._rate = float(rate)
+        self._min_rate = float(min_rate)
+        self._max_rate = float(max_rate)
+        self._max_window = float(max_window)
+        self._latency_target = latency_target
+        self._window = 1.0
+        self._slow_start = True
+        self._in_flight = 0
+        self._tokens = 1.0
+        self._stamp = time.time()
+        # no request is sent before this time, set by Retry-After.
+        self._paused_until = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _Refill(self, now):
+        """Add the tokens earned since the last refill.
+
+        Must be called with the lock held.
+        """
+        earned = (now - self._stamp) * self._rate
+        self._tokens = min(max(1.0, self._rate), self._tokens + earned)
+        self._stamp = now
+
+    def Acquire(self, requests=1, timeout=None):
+        """Block until requests may be sent to the host.
+
+        Args:
+            requests: how many requests are sent, e.g. the size of a
+                      pipelined batch. They take one place in the window
+                      and a token each. A batch larger than the bucket
+                      leaves it in debt, which the requests after it wait
+                      to pay off.
+            timeout: optional seconds to wait at most.
+
+        Returns:
+            True when the requests may be sent, False when the timeout
+            passed first. Release must only be called after True.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._cond.acquire()
+        try:
+            while True:
+                now = time.time()
+                self._Refill(now)
+                need = min(float(requests), max(1.0, self._rate))
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight >= int(self._window):
+                    wait = None
+                elif self._tokens < need:
+                    wait = (need - self._tokens) / self._rate
+                else:
+                    self._tokens -= requests
+                    self._in_flight += 1
+                    return True
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    if wait is None or wait > deadline - now:
+                        wait = deadline - now
+                self._cond.wait(wait)
+        finally:
+            self._cond.release()
+
+    def Release(self, latency, outcome, retry_after=None):
+        """Report how a request went.
+
+        Args:
+            latency: seconds the request took.
+            outcome: 'ok', 'timeout', 'overload' for a 5xx status, or
+                     'error' for failures that say nothing about the load.
+            retry_after: the Retry-After header of an overload response.
+                         The host is paused for at most _MAX_RETRY_AFTER
+                         seconds.
+        """
+        self._cond.acquire()
+        try:
+            self._in_flight -= 1
+            if outcome == 'ok' and latency <= self._latency_target:
+                if self._slow_start:
+                    window_step = max(1.0 / self._window, self._window / 4)
+                    rate_step = max(_RATE_STEP, self._rate / 4)
+                else:
+                    window_step = 1.0 / self._window
+                    rate_step = _RATE_STEP
+                self._window = min(self._max_window,
+                                   self._window + window_step)
+                self._rate = min(self._max_rate, self._rate + rate_step)
+            elif outcome in ('ok', 'timeout', 'overload'):
+                self._slow_start = False
+                self._window = max(1.0, self._window / 2)
+                self._rate = max(self._min_rate, self._rate / 2)
+            if retry_after and retry_after.isdigit():
+                self._paused_until = time.time() + min(int(retry_after),
+                                                       _MAX_RETRY_AFTER)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def GetStats(self):
+        """Return the current pace.
+
+        Returns:
+            A dict with the rate, window and in_flight keys.
+        """
+        self._cond.acquire()
+        try:
+            return {'rate': self._rate, 'window': self._window,
+                    'in_flight': self._in_flight}
+        finally:
+            self._cond.release()
+
+
+def GetHostScheduler(server):
+    """Return the scheduler shared by everyone talking to a server.
+
+    Args:
+        server: the target server.
+
+    Returns:
+        A HostScheduler object.
+    """
+    _schedulers_lock.acquire()
+    try:
+        if server not in _schedulers:
+            _schedulers[server] = HostScheduler()
+        return _schedulers[server]
+    finally:
+        _schedulers_lock.release()
+
+
+def _PruneFiles(directory, max_age, max_bytes):
+    """Delete the oldest files of a cache directory.
+
+    Args:
+        directory: the cache directory.
+        max_age: seconds since a file was written after which it is
+                 deleted, None for no limit.
+        max_bytes: the most bytes the files may take, the least recently
+                   written are deleted first. None for no limit.
+
+    Returns:
+        The number of files deleted.
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    files = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            continue
+        files.append((info.st_mtime, info.st_size, path))
+    files.sort()
+    now = time.time()
+    total = sum([size for mtime, size, path in files])
+    deleted = 0
+    for mtime, size, path in files:
+        if ((max_age is None or now - mtime <= max_age) and
+            (max_bytes is None or total <= max_bytes)):
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        deleted += 1
+    return deleted
+
+
+class HTTPCache(object):
+    """An on-disk cache of response bodies and their validators.
+
+    Entries are keyed by server and url. A cached feed is revalidated by
+    sending its ETag and Last-Modified back to the server, and when the
+    server answers 304 the body is taken from the cache. The most recently
+    used feeds are also kept in their parsed form so an unchanged feed is
+    not objectified again.
+    """
+
+    def __init__(self, directory, max_parsed=_HTTP_CACHE_PARSED):
+        """Constructor to init the object.
+
+        Args:
+            directory: where the cache entries are stored.
+            max_parsed: how many parsed feeds are kept in memory.
+        """
+        self._dir = directory
+        self._max_parsed = max_parsed
+        # (server, url, decoder) -> parsed feed, least recently used first.
+        self._parsed = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir, 0700)
+
+    def _Path(self, server, url):
+        """Return the file name of the entry for server and url."""
+        return os.path.join(self._dir, hashlib.md5(
+                            '%s\0%s' % (server, url)).hexdigest())
+
+    def Lookup(self, server, url):
+        """Return the cached entry for server and url.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+
+        Returns:
+            A dict with etag, last_modified, body and encoding keys,
+            or None.
+        """
+        try:
+            return pickle.load(open(self._Path(server, url), 'rb'))
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def Store(self, server, url, etag, last_modified, body, encoding=None):
+        """Save a response body and its validators.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            etag: the ETag response header, or None.
+            last_modified: the Last-Modified response header, or None.
+            body: the response body string, as sent over the wire.
+            encoding: the Content-Encoding response header, or None.
+        """
+        try:
+            fd, temp = tempfile.mkstemp(dir=self._dir)
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump({'etag': etag, 'last_modified': last_modified,
+                             'body': body, 'encoding': encoding}, f, 2)
+            finally:
+                f.close()
+            os.rename(temp, self._Path(server, url))
+        except (IOError, OSError):
+            # a cache that can not be written is only a missed optimization.
+            pass
+
+    def Prune(self, max_age=_HTTP_CACHE_MAX_AGE,
+              max_bytes=_HTTP_CACHE_MAX_BYTES):
+        """Delete the entries stored too long ago or past the size cap.
+
+        See _PruneFiles.
+        """
+        return _PruneFiles(self._dir, max_age, max_bytes)
+
+    def ConditionalHeaders(self, entry):
+        """Return the request headers revalidating a cached entry.
+
+        Args:
+            entry: an entry returned by Lookup.
+        """
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def GetParsed(self, server, url, decoder=None):
+        """Return the parsed feed kept for server and url, or None.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            decoder: the FieldProjector the feed was decoded with, or None
+                     when it was objectified.
+        """
+        key = (server, url, decoder)
+        self._lock.acquire()
+        try:
+            feed = self._parsed.pop(key, None)
+            if feed is not None:
+                self._parsed[key] = feed
+            return feed
+        finally:
+            self._lock.release()
+
+    def SetParsed(self, server, url, feed, decoder=None):
+        """Keep the parsed form of the cached body for server and url."""
+        key = (server, url, decoder)
+        self._lock.acquire()
+        try:
+            self._parsed.pop(key, None)
+            self._parsed[key] = feed
+            while len(self._parsed) > self._max_parsed:
+                self._parsed.popitem(last=False)
+        finally:
+            self._lock.release()
+
+
+class DefaultCRUDHandler(object):
+    """Provide a default CRUD handler.
+    """
+
+    def __init__(self, server=None, headers=None, raw=False, cache=None,
+                 executor=None):
+        """Constructor to init the object.
+
+        Args:
+            server: the target server.
+            headers: http headers.
+            raw: boolean whether send back raw HTTPResponse data.
+            cache: optional HTTPCache used to revalidate feeds.
+            executor: optional ParseExecutor the feeds requested with a
+                      decoder are parsed in.
+        """
+        self._server = server
+        self._headers = headers
+        self._raw = raw
+        self._cache = cache
+        self._executor = executor
+
+    def Prune(self):
+        """Evict the old entries of the HTTPCache, if there is one.
+
+        Returns:
+            The number of entries deleted.
+        """
+        if not self._cache:
+            return 0
+        return self._cache.Prune()
+
+    def Get(self, url, *args, **kws):
+        """Retrieve the content feed for a given url.
+
+        Args:
+            url: the url for the content feed.
+            extra_headers: any extra_headers needs to be added.
+            raw: boolean whether or not return the raw response data.
+                 If False, the feed will be fed into the Objectify module
+                 to form an feed object.
+            coalesce: boolean whether the request may share the result of
+                      an identical request in flight. Default is True.
+            stream: optional tag name, e.g. 'entry'. When given, a
+                    FeedStream yielding those elements while the feed
+                    downloads is returned instead of the whole feed.
+            fields: optional field paths the streamed entries are
+                    projected to, see objectifyxml.FieldProjector.
+            decoder: optional FieldProjector the feed is decoded with
+                     instead of objectify.
+            idempotent: boolean whether the request may be sent again when
+                        a kept-alive connection went stale. Default is True.
+
+        Returns:
+            Either a HTTPResponse object (file like) or 
+            an object reprsenting the feed (converted by objectify).
+        """
+        if 'headers' in kws:
+            headers = kws['headers']
+        else:
+            headers = self._headers
+
+        if 'server' in kws:
+            server = kws['server']
+        else:
+            server = self._server
+
+        if 'raw' in kws:
+            raw = kws['raw']
+        else:
+            raw = self._raw
+
+        if raw:
+            # the caller owns the response stream, so it gets a connection
+            # of its own which goes away together with the response.
+            conn = _CachedDNSConnection(server, timeout=_SOCKET_TIMEOUT)
+            try:
+                conn.request('GET', url, None, headers)
+                return conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                raise excepts.TransientRequestError(e)
+
+        idempotent = kws.get('idempotent', True)
+        if kws.get('stream'):
+            return self._Stream(server, url, headers, kws['stream'],
+                                kws.get('fields'), idempotent)
+
+        decoder = kws.get('decoder')
+        if not kws.get('coalesce', True):
+            return self._Fetch(server, url, headers, decoder, idempotent)
+
+        # concurrent callers asking for the same feed share one request.
+        return _flights.Do((server, url, _Authorization(headers), decoder),
+                           self._Fetch, server, url, headers, decoder,
+                           idempotent)
+
+    def _Fetch(self, server, url, headers, decoder=None, idempotent=True):
+        """Retrieve and objectify the content feed for a given url.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            headers: http headers.
+            decoder: optional FieldProjector used instead of objectify.
+            idempotent: boolean whether the request may be sent again, see
+                        _Open.
+
+        Returns:
+            An object reprsenting the feed, or what the decoder returns.
+        """
+        entry = None
+        headers = dict(headers or {})
+        headers['Accept-Encoding'] = _ACCEPT_ENCODING
+        category = GetCategoryType(url)
+        cache = self._cache
+        if category in _UNCACHED_CATEGORIES:
+            cache = None
+        if cache:
+            entry = cache.Lookup(server, url)
+            if entry:
+                headers.update(cache.ConditionalHeaders(entry))
+
+        def Handle(resp):
+            if entry and resp.status == httplib.NOT_MODIFIED:
+                return None
+            encoding = resp.getheader('content-encoding')
+            # the body is read as it came over the wire and digested first,
+            # so a body parsed before is not parsed again.
+            wire = list(_ReadChunks(resp))
+            feed = self._Parse(_Decompress(wire, encoding), category, decoder,
+                               digest=DigestChunks(wire, encoding))
+            # the cache keeps the body as it came over the wire.
+            if cache and resp.status == httplib.OK:
+                etag = resp.getheader('etag')
+                last_modified = resp.getheader('last-modified')
+                if etag or last_modified:
+                    cache.Store(server, url, etag, last_modified,
+                                ''.join(wire), encoding)
+                    cache.SetParsed(server, url, feed, decoder)
+            return feed
+
+        resp, feed = self._Request(server, url, headers, Handle, idempotent)
+        if feed is None:
+            # not modified since the cached copy.
+            feed = cache.GetParsed(server, url, decoder)
+            if feed is None:
+                wire = [entry['body']]
+                encoding = entry.get('encoding')
+                feed = self._Parse(_Decompress(wire, encoding), category,
+                                   decoder,
+                                   digest=DigestChunks(wire, encoding))
+                cache.SetParsed(server, url, feed, decoder)
+        return feed
+
+    def GetMany(self, urls, *args, **kws):
+        """Retrieve many content feeds over a few pipelined connections.
+
+        The urls are spread over up to _PIPELINE_CONNECTIONS connections.
+        On each connection all the requests are written at once and the
+        responses are read back in the same order, so a batch costs about
+        one round trip instead of one per url. When a server closes a
+        connection half way, the rest of its batch is sent again over
+        another connection.
+
+        Args:
+            urls: a list of urls for the content feeds.
+            server: optional target server.
+            headers: optional http headers.
+            decoder: optional FieldProjector used instead of objectify.
+
+        Returns:
+            A list of objects reprsenting the feeds, in the order of urls.
+            A feed that could not be retrieved gives None in its place.
+        """
+        headers = kws.get('headers', self._headers)
+        server = kws.get('server', self._server)
+        decoder = kws.get('decoder')
+        results = [None] * len(urls)
+        items = list(enumerate(urls))
+        count = min(_PIPELINE_CONNECTIONS, len(items))
+        batches = [items[i::count] for i in range(count)]
+        workers = []
+        for batch in batches[1:]:
+            worker = threading.Thread(target=self._Pipeline,
+                                      args=(server, batch, headers, results,
+                                            decoder))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        if batches:
+            self._Pipeline(server, batches[0], headers, results, decoder)
+        for worker in workers:
+            worker.join()
+        for i, result in enumerate(results):
+            if isinstance(result, _PendingParse):
+                try:
+                    results[i] = result.Wait()
+                except excepts.RequestHandlingError:
+                    results[i] = None
+        return results
+
+    def _Pipeline(self, server, items, headers, results, decoder=None):
+        """Send a batch of pipelined requests and read back the responses.
+
+        Args:
+            server: the target server.
+            items: a list of (index, url) tuples.
+            headers: http headers.
+            results: the list the feeds are stored in by index.
+            decoder: optional FieldProjector used instead of objectify.
+        """
+        headers = dict(headers or {})
+        headers['Accept-Encoding'] = _ACCEPT_ENCODING
+        pool = GetConnectionPool(server)
+        scheduler = GetHostScheduler(server)
+        while items:
+            # every pipelined request takes a token of its own. A batch
+            # that can not get its turn is given up, the feeds stay None.
+            if not scheduler.Acquire(len(items), _ACQUIRE_TIMEOUT):
+                break
+            start = time.time()
+            outcome = 'error'
+            conn, reused = pool.Acquire()
+            done = 0
+            broken = False
+            timed_out = False
+            try:
+                try:
+                    if not conn.sock:
+                        conn.connect()
+                    conn.sock.sendall(''.join([
+                        _RequestLine(server, url, headers)
+                        for index, url in items]))
+                    shared = _SharedFile(conn.sock)
+                    for index, url in items:
+                        resp = httplib.HTTPResponse(shared, method='GET')
+                        resp.begin()
+                        if resp.status >= 500:
+                            outcome = 'overload'
+                        elif resp.status == httplib.OK:
+                            # with an executor the feed is parsed while the
+                            # next responses are read.
+                            wire = list(_ReadChunks(resp))
+                            encoding = resp.getheader('content-encoding')
+                            try:
+                                results[index] = self._Parse(
+                                    _Decompress(wire, encoding),
+                                    GetCategoryType(url), decoder,
+                                    wait=False,
+                                    digest=DigestChunks(wire, encoding))
+                            except excepts.RequestHandlingError:
+                                pass
+                        resp.read()
+                        done += 1
+                        if resp.will_close:
+                            broken = True
+                            break
+                except socket.timeout:
+                    broken = True
+                    timed_out = True
+                except (httplib.HTTPException, socket.error):
+                    broken = True
+                if timed_out:
+                    outcome = 'timeout'
+                elif done and outcome != 'overload':
+                    outcome = 'ok'
+            finally:
+                if broken:
+                    pool.Discard(conn)
+                else:
+                    pool.Release(conn)
+                scheduler.Release(time.time() - start, outcome)
+            if timed_out or (not done and not reused):
+                # the server may still be handling the requests after a
+                # timeout, and a fresh connection that got nothing through
+                # will not do better, so give up on these.
+                break
+            items = items[done:]
+
+    def _Parse(self, chunks, category, decoder=None, wait=True, digest=None):
+        """Objectify a feed.
+
+        Args:
+            chunks: an iterable of the feed xml string chunks.
+            category: the category type of the feed.
+            decoder: optional FieldProjector used instead of objectify.
+            wait: boolean whether to wait for a feed handed to the
+                  executor. If False, a _PendingParse is returned for it.
+            digest: optional DigestChunks of the body, so a body parsed
+                    before is looked up before it is parsed.
+
+        Returns:
+            An object reprsenting the feed, or what the decoder returns.
+
+        Raises:
+            RequestHandlingError: when the feed can not be parsed.
+        """
+        if decoder and self._executor:
+            try:
+                pending = self._executor.Submit(''.join(chunks), category,
+                                                decoder)
+            except zlib.error, e:
+                raise excepts.RequestHandlingError(e)
+            if wait:
+                return pending.Wait()
+            return pending
+        try:
+            # feeds are wrapped lazily, callers rarely read all of a feed.
+            parser = ContentParser(chunks, category, lazy=True,
+                                   memo=_parse_memo, digest=digest)
+            if decoder:
+                return parser.project(decoder)
+            return parser.objectify()
+        except (SyntaxError, TypeError, zlib.error), e:
+            raise excepts.RequestHandlingError(e)
+
+    def _Request(self, server, url, headers, handle, idempotent=True):
+        """Send a GET request over a pooled connection and handle the response.
+
+        The request waits for the host scheduler first and reports back how
+        it went, so the scheduler can adapt the pace to the server.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            headers: http headers.
+            handle: a callable reading the response body. It is called with
+                    the HTTPResponse while the connection is still held.
+            idempotent: boolean whether the request may be sent again, see
+                        _Open.
+
+        Returns:
+            A tuple of (HTTPResponse, what handle returns).
+
+        Raises:
+            TransientRequestError: when the request can not be completed or
+                                   the server answered with a 5xx status.
+            RequestHandlingError: when the server answered with a 4xx
+                                  status or the feed can not be parsed.
+        """
+        scheduler = GetHostScheduler(server)
+        if not scheduler.Acquire(timeout=_ACQUIRE_TIMEOUT):
+            raise excepts.TransientRequestError('%s%s: host busy' % (server,
+                                                                      url))
+        start = time.time()
+        outcome = 'error'
+        retry_after = None
+        try:
+            try:
+                resp, result = self._Send(server, url, headers, handle,
+                                          idempotent)
+            except excepts.RequestHandlingError, e:
+                if e.args and isinstance(e.args[0], socket.timeout):
+                    outcome = 'timeout'
+                raise
+            if resp.status >= 500:
+                outcome = 'overload'
+                retry_after = resp.getheader('retry-after')
+                raise excepts.TransientRequestError('%s%s: %d %s' % (
+                    server, url, resp.status, resp.reason))
+            outcome = 'ok'
+            if resp.status >= 400:
+                raise excepts.RequestHandlingError('%s%s: %d %s' % (
+                    server, url, resp.status, resp.reason))
+            return resp, result
+        finally:
+            scheduler.Release(time.time() - start, outcome, retry_after)
+
+    def _Send(self, server, url, headers, handle, idempotent=True):
+        """Send a GET request over a pooled connection.
+
+        A 4xx or 5xx response is not given to handle.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            headers: http headers.
+            handle: a callable reading the response body.
+            idempotent: boolean whether the request may be sent again, see
+                        _Open.
+
+        Returns:
+            A tuple of (HTTPResponse, what handle returns).
+
+        Raises:
+            TransientRequestError: when the request can not be completed.
+            RequestHandlingError: when handle fails.
+        """
+        pool, conn, resp = self._Open(server, url, headers, idempotent)
+        try:
+            result = None
+            if resp.status < 400:
+                result = handle(resp)
+            # whatever the handler left unread must go before reuse.
+            resp.read()
+        except excepts.RequestHandlingError:
+            pool.Discard(conn)
+            raise
+        except (httplib.HTTPException, socket.error), e:
+            pool.Discard(conn)
+            raise excepts.TransientRequestError(e)
+        if resp.will_close:
+            pool.Discard(conn)
+        else:
+            pool.Release(conn)
+        return resp, result
+
+    def _Open(self, server, url, headers, idempotent=True):
+        """Send a GET request and read the response status and headers.
+
+        A kept-alive connection may have been closed by the server while it
+        sat in the pool. In that case an idempotent request is sent once
+        more over a fresh connection. A timeout is raised right away, the
+        server may still be handling the request.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            headers: http headers.
+            idempotent: boolean whether the request may be sent again. A
+                        request with side effects may have reached the
+                        server before the connection broke.
+
+        Returns:
+            A tuple of (ConnectionPool, connection, HTTPResponse). The
+            caller gives the connection back to the pool.
+
+        Raises:
+            TransientRequestError: when the request can not be sent.
+            RequestHandlingError: when a header value is malformed.
+        """
+        pool = GetConnectionPool(server)
+        while True:
+            conn, reused = pool.Acquire()
+            try:
+                conn.request('GET', url, None, headers)
+                return pool, conn, conn.getresponse()
+            except socket.timeout, e:
+                # a server that is slow, not a socket that went stale.
+                pool.Discard(conn)
+                raise excepts.TransientRequestError(e)
+            except _STALE_ERRORS, e:
+                pool.Discard(conn)
+                if not reused or not idempotent:
+                    raise excepts.TransientRequestError(e)
+            except httplib.HTTPException, e:
+                pool.Discard(conn)
+                raise excepts.TransientRequestError(e)
+            except ValueError, e:
+                # ValueError is what httplib raises for a bad header.
+                pool.Discard(conn)
+                raise excepts.RequestHandlingError(e)
+
+    def _Stream(self, server, url, headers, tag, fields=None,
+                idempotent=True):
+        """Send a GET request and stream the entries of the feed.
+
+        With an HTTPCache the request revalidates the cached body. When the
+        feed was not modified, the cached body is streamed instead, and a
+        new body is stored once it has been read in full.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            headers: http headers.
+            tag: the tag name of the entries.
+            fields: optional field paths the entries are projected to.
+            idempotent: boolean whether the request may be sent again, see
+                        _Open.
+
+        Returns:
+            A FeedStream object.
+
+        Raises:
+            TransientRequestError: when the request can not be completed or
+                                   the server answered with a 5xx status.
+            RequestHandlingError: when the server answered with a 4xx
+                                  status.
+        """
+        headers = dict(headers or {})
+        headers['Accept-Encoding'] = _ACCEPT_ENCODING
+        entry = None
+        cache = self._cache
+        if GetCategoryType(url) in _UNCACHED_CATEGORIES:
+            cache = None
+        if cache:
+            entry = cache.Lookup(server, url)
+            if entry:
+                headers.update(cache.ConditionalHeaders(entry))
+        scheduler = GetHostScheduler(server)
+        if not scheduler.Acquire(timeout=_ACQUIRE_TIMEOUT):
+            raise excepts.TransientRequestError('%s%s: host busy' % (server,
+                                                                      url))
+        start = time.time()
+        try:
+            pool, conn, resp = self._Open(server, url, headers, idempotent)
+        except excepts.RequestHandlingError, e:
+            if e.args and isinstance(e.args[0], socket.timeout):
+                scheduler.Release(time.time() - start, 'timeout')
+            else:
+                scheduler.Release(time.time() - start, 'error')
+            raise
+        if resp.status >= 500:
+            pool.Discard(conn)
+            scheduler.Release(time.time() - start, 'overload',
+                              resp.getheader('retry-after'))
+            raise excepts.TransientRequestError('%s%s: %d %s' % (
+                server, url, resp.status, resp.reason))
+        if resp.status >= 400:
+            pool.Discard(conn)
+            scheduler.Release(time.time() - start, 'ok')
+            raise excepts.RequestHandlingError('%s%s: %d %s' % (
+                server, url, resp.status, resp.reason))
+        # the host answered; how fast the caller reads the body is not the
+        # host's pace, and must not hold the window up.
+        scheduler.Release(time.time() - start, 'ok')
+        replay = None
+        store = None
+        if entry and resp.status == httplib.NOT_MODIFIED:
+            replay = entry
+        elif cache and resp.status == httplib.OK:
+            etag = resp.getheader('etag')
+            last_modified = resp.getheader('last-modified')
+            encoding = resp.getheader('content-encoding')
+            if etag or last_modified:
+                def store(body):
+                    cache.Store(server, url, etag, last_modified, body,
+                                encoding)
+        return FeedStream(pool, conn, resp, tag, fields, replay, store)
+
+
+class FeedStream(object):
+    """Iterate over the entries of a feed while it downloads.
+
+    The connection the feed comes over is held until the entries are all
+    read or the stream is closed.
+    """
+
+    def __init__(self, pool, conn, resp, tag, fields=None, replay=None,
+                 store=None):
+        """Constructor to init the object.
+
+        Args:
+            pool: the ConnectionPool the connection belongs to.
+            conn: the connection.
+            resp: the HTTPResponse whose status has been read.
+            tag: the tag name of the entries.
+            fields: optional field paths the entries are projected to.
+            replay: optional HTTPCache entry whose body is streamed instead
+                    of the response body, e.g. for a 304 response.
+            store: optional callable given the body as sent over the wire,
+                   once it has been read in full.
+        """
+        self._pool = pool
+        self._conn = conn
+        self._resp = resp
+        self._done = False
+        self._store = store
+        self._wire = None
+        if replay is not None:
+            chunks = _Decompress([replay['body']], replay.get('encoding'))
+        else:
+            if store:
+                self._wire = []
+            chunks = _Decompress(_ReadChunks(resp, self._wire),
+                                 resp.getheader('content-encoding'))
+        self._entries = EntryStream(_ChunkReader(chunks), tag, fields=fields)
+
+    def GetStatus(self):
+        """Return the feed status text, once the entries started coming."""
+        return self._entries.status
+
+    def __iter__(self):
+        """Yield the entry objects as they are parsed.
+
+        Raises:
+            RequestHandlingError: when the feed can not be read or parsed.
+        """
+        try:
+            for entry in self._entries:
+                yield entry
+            self._resp.read()
+        except (SyntaxError, zlib.error, httplib.HTTPException,
+                socket.error), e:
+            self._Finish('error')
+            raise excepts.RequestHandlingError(e)
+        self._Finish('ok')
+        if self._wire is not None:
+            self._store(''.join(self._wire))
+            self._wire = None
+
+    def _Finish(self, outcome):
+        """Give the connection back."""
+        if self._done:
+            return
+        self._done = True
+        if outcome == 'ok' and not self._resp.will_close:
+            self._pool.Release(self._conn)
+        else:
+            self._pool.Discard(self._conn)
+
+    def close(self):
+        """Stop reading the feed and drop its connection."""
+        self._Finish('error')
+
+    __del__ = close
+
+
+class _ChunkReader(object):
+    """A file like object reading from an iterable of string chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += self._chunks.next()
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class _SharedFile(object):
+    """Let several HTTPResponse objects read from one buffered socket file.
+
+    HTTPResponse reads from the file its socket makes and closes it once the
+    body is read. Pipelined responses follow each other on the same socket,
+    so they share one buffered file which is never closed by them.
+    """
+
+    def __init__(self, sock):
+        self._fp = sock.makefile('rb')
+
+    def makefile(self, *args, **kws):
+        return self
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+def _RequestLine(server, url, headers):
+    """Return a GET request as it is sent over the wire.
+
+    Args:
+        server: the target server.
+        url: the url for the content feed.
+        headers: http headers.
+    """
+    lines = ['GET %s HTTP/1.1' % url, 'Host: %s' % server]
+    for k, v in headers.iteritems():
+        lines.append('%s: %s' % (k, str(v).strip()))
+    return '\r\n'.join(lines) + '\r\n\r\n'
 
-    Returns:
-        A string reprsenting the feed category type.
+
+def _ReadChunks(resp, keep=None):
+    """Read a response body chunk by chunk.
+
+    Args:
+        resp: the HTTPResponse.
+        keep: optional list every chunk read is appended to.
+
+    Yields:
+        The body string chunks.
     """
-    m = pattern.match(url)
-    return m.groups()[0]
+    while True:
+        chunk = resp.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        if keep is not None:
+            keep.append(chunk)
+        yield chunk
 
 
-def GetElementTagFromData(data):
-    """Return the xml tag names in an element.
+def _Decompress(chunks, encoding):
+    """Decompress the chunks of a body sent with a Content-Encoding.
 
     Args:
-        data: an xml element.
+        chunks: an iterable of body string chunks.
+        encoding: the Content-Encoding response header, or None.
 
-    Returns:
-        A list of tag names for a given element.
+    Yields:
+        The decompressed string chunks.
     """
-    return [i.tag for i in data.GetElementData().getiterator()][1:]
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = None
+    else:
+        for chunk in chunks:
+            yield chunk
+        return
+
+    for chunk in chunks:
+        if decompressor is None:
+            # deflate is meant to be zlib wrapped but some servers send
+            # the raw stream, so tell them apart on the first chunk.
+            decompressor = zlib.decompressobj()
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = decompressor.decompress(chunk)
+        else:
+            data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if decompressor is not None:
+        data = decompressor.flush()
+        if data:
+            yield data
 
+def _ParseInWorker(body, category, decoder):
+    """Decode a feed body in a ParseExecutor process."""
+    try:
+        return ContentParser(body, category).project(decoder)
+    except SyntaxError, e:
+        # cElementTree.ParseError does not pickle.
+        raise SyntaxError(str(e))
 
-class DefaultCRUDHandler(object):
-    """Provide a default CRUD handler.
+
+class _PendingParse(object):
+    """A feed handed to a ParseExecutor."""
+
+    def __init__(self, result):
+        self._result = result
+
+    def Wait(self):
+        """Wait for the decoded feed.
+
+        Returns:
+            What the decoder returns.
+
+        Raises:
+            RequestHandlingError: when the feed can not be parsed in time.
+        """
+        try:
+            # a timeout keeps the wait interruptible.
+            return self._result.get(_SOCKET_TIMEOUT)
+        except (SyntaxError, TypeError, multiprocessing.TimeoutError), e:
+            raise excepts.RequestHandlingError(e)
+
+
+class ParseExecutor(object):
+    """Parse feed bodies in a pool of worker processes.
+
+    Parsing holds the GIL, so on a bulk crawl it keeps a single core busy
+    while the others idle. The executor ships the raw bodies to worker
+    processes, which decode them with the given decoder and send back the
+    compact result, e.g. the tuples of a FieldProjector or the plain dicts
+    of a DictDecoder. __BASE__ objects are never built in the workers.
+
+    Thread-safe. The workers are started on first use.
+    """
+
+    def __init__(self, processes=None):
+        """Constructor to init the object.
+
+        Args:
+            processes: the number of worker processes, None for one per
+                       cpu.
+        """
+        self._processes = processes
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def Submit(self, body, category, decoder):
+        """Hand a feed body to the workers.
+
+        Args:
+            body: the feed xml string.
+            category: the category type of the feed.
+            decoder: a picklable decoder, e.g. a FieldProjector.
+
+        Returns:
+            A _PendingParse object.
+        """
+        self._lock.acquire()
+        try:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self._processes)
+            pool = self._pool
+        finally:
+            self._lock.release()
+        return _PendingParse(pool.apply_async(_ParseInWorker,
+                                              (body, category, decoder)))
+
+    def Parse(self, body, category, decoder):
+        """Decode a feed body in the workers and wait for it.
+
+        See Submit and _PendingParse.Wait.
+        """
+        return self.Submit(body, category, decoder).Wait()
+
+    def Close(self):
+        """Stop the workers once they finished the feeds handed to them."""
+        self._lock.acquire()
+        try:
+            pool, self._pool = self._pool, None
+        finally:
+            self._lock.release()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class PendingRequest(object):
+    """A request submitted to the ConcurrentCRUDHandler.
+
+    The result becomes available once the request has been handled.
+    """
+
+    def __init__(self, server, url, kws, callback=None):
+        """Constructor to init the object.
+
+        Args:
+            server: the target server.
+            url: the url for the content feed.
+            kws: extra keyword args passed to the handler.
+            callback: optional callable called with this object once done.
+        """
+        self.server = server
+        self.url = url
+        self._kws = kws
+        self._callback = callback
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _Finish(self, result=None, error=None):
+        """Record the outcome and wake up the waiters."""
+        self._result = result
+        self._error = error
+        self._done.set()
+        if self._callback:
+            self._callback(self)
+
+    def Done(self):
+        """Boolean whether the request has been handled."""
+        return self._done.isSet()
+
+    def Wait(self, timeout=None):
+        """Wait for the request to complete and return its result.
+
+        Args:
+            timeout: optional seconds to wait for.
+
+        Returns:
+            The handler result.
+
+        Raises:
+            RequestHandlingError: when the request failed or timed out.
+        """
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise excepts.RequestHandlingError(
+                'timed out waiting for %s%s' % (self.server, self.url))
+        if self._error:
+            raise self._error
+        return self._result
+
+
+class ConcurrentCRUDHandler(DefaultCRUDHandler):
+    """A CRUD handler that runs many requests at the same time.
+
+    Requests are dispatched to their own threads as long as the number of
+    requests in flight stays under both the per host and the total cap.
+    The rest wait in a per host queue, so one slow host never holds back
+    requests to the others.
+
+    Get keeps the blocking DefaultCRUDHandler interface, so the handler can
+    be registered with CroukeClient.RegisterHandlers. Submit and GetMany
+    issue requests without waiting for each other.
     """
 
-    def __init__(self, server=None, headers=None, raw=False):
+    def __init__(self, server=None, headers=None, raw=False, cache=None,
+                 per_host=_MAX_PER_HOST, total=_MAX_IN_FLIGHT,
+                 executor=None):
         """Constructor to init the object.
 
         Args:
             server: the target server.
             headers: http headers.
             raw: boolean whether send back raw HTTPResponse data.
+            cache: optional HTTPCache used to revalidate feeds.
+            per_host: the maximum requests in flight for one host.
+            total: the maximum requests in flight for all hosts.
+            executor: optional ParseExecutor the feeds requested with a
+                      decoder are parsed in.
         """
-        self._server = server
-        self._headers = headers
-        self._raw = raw
+        super(ConcurrentCRUDHandler, self).__init__(server, headers, raw,
+                                                    cache, executor)
+        self._per_host = per_host
+        self._total = total
+        self._lock = threading.Lock()
+        # host -> list of waiting PendingRequest objects, in arrival order.
+        self._waiting = {}
+        # host -> number of requests in flight.
+        self._running = {}
+        self._in_flight = 0
 
-    def Get(self, url, *args, **kws):
-        """Retrieve the content feed for a given url.
+    def Submit(self, url, callback=None, *args, **kws):
+        """Queue a request and return without waiting for it.
 
         Args:
             url: the url for the content feed.
-            extra_headers: any extra_headers needs to be added.
-            raw: boolean whether or not return the raw response data.
-                 If False, the feed will be fed into the Objectify module
-                 to form an feed object.
+            callback: optional callable called with the PendingRequest
+                      once it is done. It runs on the worker thread.
+            kws: extra keyword args passed to DefaultCRUDHandler.Get.
 
         Returns:
-            Either a HTTPResponse object (file like) or 
-            an object reprsenting the feed (converted by objectify).
+            A PendingRequest object.
         """
-        if 'headers' in kws:
-            headers = kws['headers']
-        else:
-            headers = self._headers
+        server = kws.get('server', self._server)
+        req = PendingRequest(server, url, kws, callback)
+        self._lock.acquire()
+        try:
+            self._waiting.setdefault(server, []).append(req)
+            self._Dispatch()
+        finally:
+            self._lock.release()
+        return req
 
-        if 'server' in kws:
-            server = kws['server']
-        else:
-            server = self._server
+    def _Dispatch(self):
+        """Start waiting requests while the caps allow it.
 
-        if 'raw' in kws:
-            raw = kws['raw']
+        Must be called with the lock held.
+        """
+        for server, queue in self._waiting.items():
+            while (queue and self._in_flight < self._total and
+                   self._running.get(server, 0) < self._per_host):
+                req = queue.pop(0)
+                self._running[server] = self._running.get(server, 0) + 1
+                self._in_flight += 1
+                worker = threading.Thread(target=self._Run, args=(req,))
+                worker.setDaemon(True)
+                worker.start()
+            if not queue:
+                del self._waiting[server]
+
+    def _Run(self, req):
+        """Handle one request on a worker thread."""
+        try:
+            try:
+                result = DefaultCRUDHandler.Get(self, req.url, **req._kws)
+            except excepts.RequestHandlingError, e:
+                error = e
+            except Exception, e:
+                error = excepts.RequestHandlingError(e)
+            else:
+                error = None
+        finally:
+            self._lock.acquire()
+            try:
+                self._running[req.server] -= 1
+                self._in_flight -= 1
+                self._Dispatch()
+            finally:
+                self._lock.release()
+        if error:
+            req._Finish(error=error)
         else:
-            raw = self._raw
+            req._Finish(result=result)
 
-        conn = httplib.HTTPConnection(server)
-        conn.request('GET', url, None, headers)
-        resp = conn.getresponse()
-        if raw:
-            return resp
+    def Get(self, url, *args, **kws):
+        """Retrieve the content feed for a given url within the caps.
+
+        Args:
+            url: the url for the content feed.
+            kws: extra keyword args passed to DefaultCRUDHandler.Get.
+
+        Returns:
+            Same as DefaultCRUDHandler.Get.
+        """
+        return self.Submit(url, None, **kws).Wait()
+
+    def GetMany(self, requests, **kws):
+        """Retrieve many content feeds at the same time.
+
+        Args:
+            requests: a list of urls or (server, url) tuples.
+            kws: extra keyword args passed to DefaultCRUDHandler.Get.
+
+        Returns:
+            A list of results in the order of requests. A request that
+            failed gives None in its place.
+        """
+        pending = []
+        for req in requests:
+            req_kws = dict(kws)
+            if isinstance(req, tuple):
+                req_kws['server'], req = req
+            pending.append(self.Submit(req, None, **req_kws))
+        results = []
+        for req in pending:
+            try:
+                results.append(req.Wait())
+            except excepts.RequestHandlingError:
+                results.append(None)
+        return results
+
+
+class RequestPolicy(object):
+    """Retry, deadline and hedging policy for handler calls.
+
+    An idempotent call that failed with a TransientRequestError, e.g. a
+    transport error, a timeout or a 5xx response, is retried after a capped
+    exponential backoff with full jitter, as long as the deadline allows
+    it. Other failures, e.g. a rejected login or a feed that can not be
+    parsed, are raised right away. An idempotent call that is
+    still running once it is slower than the hedge percentile of the recent
+    calls gets a second copy sent, and whichever copy answers first wins.
+    """
+
+    def __init__(self, retries=_RETRIES, backoff=_BACKOFF,
+                 max_backoff=_MAX_BACKOFF, deadline=None,
+                 hedge_percentile=None):
+        """Constructor to init the object.
+
+        Args:
+            retries: how many times a failed call is tried again.
+            backoff: the base backoff in seconds, doubled on every retry.
+            max_backoff: the cap of the backoff in seconds.
+            deadline: optional seconds a call may take in total, retries
+                      included.
+            hedge_percentile: optional latency percentile, e.g. 95, after
+                              which an idempotent call is hedged.
+        """
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._deadline = deadline
+        self._hedge_percentile = hedge_percentile
+        self._latencies = collections.deque(maxlen=_LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def _HedgeDelay(self):
+        """Return the seconds to wait before hedging, or None."""
+        if not self._hedge_percentile:
+            return None
+        self._lock.acquire()
+        try:
+            if len(self._latencies) < _HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        finally:
+            self._lock.release()
+        index = int(len(latencies) * self._hedge_percentile / 100.0)
+        return latencies[min(index, len(latencies) - 1)]
+
+    def _Record(self, latency):
+        """Remember the latency of a successful call."""
+        self._lock.acquire()
+        try:
+            self._latencies.append(latency)
+        finally:
+            self._lock.release()
+
+    def Call(self, func, args=(), kws=None, idempotent=False):
+        """Call func under this policy.
+
+        Args:
+            func: the handler method.
+            args: args passed to func.
+            kws: keyword args passed to func.
+            idempotent: boolean whether the call may be retried and
+                        hedged.
+
+        Returns:
+            What func returns.
+
+        Raises:
+            RequestHandlingError: when every try failed or the deadline
+                                  passed.
+        """
+        kws = kws or {}
+        deadline = None
+        if self._deadline:
+            deadline = time.time() + self._deadline
+        attempt = 0
+        while True:
+            try:
+                return self._Attempt(func, args, kws, deadline, idempotent)
+            except excepts.TransientRequestError:
+                if not idempotent or attempt >= self._retries:
+                    raise
+                delay = random.uniform(0, min(self._max_backoff,
+                                              self._backoff * 2 ** attempt))
+                if deadline and time.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    def _Attempt(self, func, args, kws, deadline, idempotent):
+        """Make one try of a call, hedged when it is slow."""
+        hedge = None
+        if idempotent:
+            hedge = self._HedgeDelay()
+        start = time.time()
+        if not deadline and hedge is None:
+            result = func(*args, **kws)
+            self._Record(time.time() - start)
+            return result
+
+        # the copies run on threads of their own, so the caller can stop
+        # waiting at the deadline or send a hedge.
+        results = Queue.Queue()
+
+        def Run(call_kws):
+            try:
+                results.put((True, func(*args, **call_kws)))
+            except Exception, e:
+                if not isinstance(e, excepts.RequestHandlingError):
+                    e = excepts.RequestHandlingError(e)
+                results.put((False, e))
+
+        def Start(call_kws):
+            worker = threading.Thread(target=Run, args=(call_kws,))
+            worker.setDaemon(True)
+            worker.start()
+
+        Start(kws)
+        running = 1
+        error = None
+        while running:
+            timeout = None
+            if deadline:
+                timeout = max(0, deadline - time.time())
+            if hedge is not None:
+                hedge_at = max(0, start + hedge - time.time())
+                if timeout is None or hedge_at < timeout:
+                    timeout = hedge_at
+            try:
+                ok, value = results.get(True, timeout)
+            except Queue.Empty:
+                if hedge is not None and (not deadline or
+                                          time.time() < deadline):
+                    # the hedge must not join the slow copy's request.
+                    hedge_kws = dict(kws)
+                    hedge_kws['coalesce'] = False
+                    Start(hedge_kws)
+                    running += 1
+                    hedge = None
+                    continue
+                raise excepts.RequestHandlingError(
+                    'deadline of %ss exceeded' % self._deadline)
+            running -= 1
+            if ok:
+                self._Record(time.time() - start)
+                return value
+            error = value
+        raise error
+
+
+class MemoryTier(object):
+    """The in-process tier of a handler chain.
+
+    Keeps the most recently used feeds in memory for ttl seconds. Misses
+    return None so that CroukeClient moves on to the next handler, and the
+    feeds the slower handlers return are stored back through Store.
+    """
+
+    # local handlers are called without the client request policy.
+    local = True
+
+    def __init__(self, server=None, size=_MEMORY_TIER_SIZE, ttl=_TIER_TTL,
+                 headers=None):
+        """Constructor to init the object.
+
+        Args:
+            server: the default target server.
+            size: how many feeds are kept.
+            ttl: seconds a feed is kept for.
+            headers: the default http headers of the requests, whose
+                     authorization is part of the key of every feed.
+        """
+        self._server = server
+        self._headers = headers
+        self._size = size
+        self._ttl = ttl
+        # key -> (expiry time, feed), least recently used first.
+        self._feeds = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def Get(self, url, *args, **kws):
+        """Return the kept feed for a given url, or None."""
+        key = _TierKey(self._server, self._headers, url, kws)
+        if not key:
+            return None
+        self._lock.acquire()
+        try:
+            entry = self._feeds.pop(key, None)
+            if not entry or entry[0] < time.time():
+                return None
+            self._feeds[key] = entry
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def Store(self, url, feed, *args, **kws):
+        """Keep the feed retrieved for a given url."""
+        key = _TierKey(self._server, self._headers, url, kws)
+        if not key:
+            return
+        self._lock.acquire()
+        try:
+            self._feeds.pop(key, None)
+            self._feeds[key] = (time.time() + self._ttl, feed)
+            while len(self._feeds) > self._size:
+                self._feeds.popitem(last=False)
+        finally:
+            self._lock.release()
+
+
+class DiskTier(object):
+    """The persistent tier of a handler chain.
+
+    Keeps feeds on disk for ttl seconds. Objectified feeds are saved as
+    their xml and objectified again when read back.
+    """
+
+    local = True
+
+    def __init__(self, directory, server=None, ttl=_TIER_TTL, headers=None):
+        """Constructor to init the object.
+
+        Args:
+            directory: where the feeds are stored.
+            server: the default target server.
+            ttl: seconds a feed is kept for.
+            headers: the default http headers of the requests, see
+                     MemoryTier.
+        """
+        self._dir = directory
+        self._server = server
+        self._headers = headers
+        self._ttl = ttl
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir, 0700)
+
+    def _Path(self, key):
+        """Return the file name of the feed for a key."""
+        return os.path.join(self._dir, hashlib.md5(
+                            '%s\0%s\0%s\0%r' % key).hexdigest())
+
+    def Get(self, url, *args, **kws):
+        """Return the stored feed for a given url, or None."""
+        key = _TierKey(self._server, self._headers, url, kws)
+        if not key:
+            return None
+        path = self._Path(key)
+        try:
+            if os.path.getmtime(path) + self._ttl < time.time():
+                return None
+            kind, data = pickle.load(open(path, 'rb'))
+        except (OSError, IOError, EOFError, ValueError,
+                pickle.UnpicklingError):
+            return None
+        if kind == 'xml':
+            try:
+                return ContentParser(data, GetCategoryType(url),
+                                     lazy=True).objectify()
+            except (SyntaxError, TypeError, AttributeError):
+                return None
+        return data
+
+    def Store(self, url, feed, *args, **kws):
+        """Save the feed retrieved for a given url."""
+        key = _TierKey(self._server, self._headers, url, kws)
+        if not key:
+            return
+        if isinstance(feed, __BASE__):
+            record = ('xml', str(feed))
         else:
+            record = ('object', feed)
+        try:
+            fd, temp = tempfile.mkstemp(dir=self._dir)
+            f = os.fdopen(fd, 'wb')
             try:
-                feed = ContentParser(resp.read(),
-                              GetCategoryType(url)).objectify()
-            except (SyntaxError, TypeError), e:
-                raise excepts.RequestHandlingError(e)
-        return feed
+                pickle.dump(record, f, 2)
+            finally:
+                f.close()
+            os.rename(temp, self._Path(key))
+        except (IOError, OSError, pickle.PicklingError, TypeError):
+            pass
+
+    def Prune(self, max_bytes=_DISK_TIER_MAX_BYTES):
+        """Delete the feeds older than the ttl or past the size cap.
+
+        Returns:
+            The number of feeds deleted.
+        """
+        return _PruneFiles(self._dir, self._ttl, max_bytes)
+
+
+def _Authorization(headers):
+    """Return the authorization header value of http headers, or None."""
+    for k, v in (headers or {}).iteritems():
+        if k.lower() == 'authorization':
+            return v
+    return None
+
+
+def _TierKey(server, headers, url, kws):
+    """Return the key a tier keeps a feed under, or None if it can not.
+
+    The key holds the authorization the feed was requested with, so a feed
+    is never handed to a request made with other credentials.
+
+    Args:
+        server: the default target server of the tier.
+        headers: the default http headers of the tier.
+        url: the url for the content feed.
+        kws: the keyword args of the request.
+    """
+    if kws.get('raw') or kws.get('stream'):
+        return None
+    if GetCategoryType(url) in _UNCACHED_CATEGORIES:
+        return None
+    auth = _Authorization(kws.get('headers', headers))
+    return (kws.get('server', server), auth, url, kws.get('decoder'))
+
+
+class _HandlerStats(object):
+    """Hit and latency counters of a handler in a chain."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.latency = 0.0
+
+    def AsDict(self):
+        calls = self.hits + self.misses + self.errors
+        return {'hits': self.hits, 'misses': self.misses,
+                'errors': self.errors, 'latency': self.latency,
+                'average_latency': calls and self.latency / calls or 0.0}
 
 
 class CroukeClient(object):
@@ -110,9 +2194,12 @@ class CroukeClient(object):
     The actual implemention for the Get is provided by the handler instance.
     With loose coupling, others can develop CRUD methods and register them 
     into their client object for their own CRUD requirements.
-    """
 
-    _CRUD = {'Get': [], 'Post': [], 'Put': [], 'Delete': []}
+    Handlers are tried in the order they were registered, until one of them
+    returns something. Handlers before it that provide a Store method get
+    the result stored back, so a chain like MemoryTier, DiskTier and
+    DefaultCRUDHandler promotes network results to the faster tiers.
+    """
 
     def __init__(self, user=None, password=None, server=None, headers=None, 
                  extra_headers=None, *args, **kws):
@@ -127,13 +2214,17 @@ class CroukeClient(object):
         self._headers = headers
         if not self._headers and (user and password):
             self._headers = {'authorization' :
-            'Basic ' + base64.encodestring('%s:%s' % (user, password))}
+            'Basic ' + base64.b64encode('%s:%s' % (user, password))}
         if extra_headers:
             for k, v in extra_headers.iteritems():
                 self._headers[k] = v
         self._args = args
         self._kws = kws
         self._logger = None
+        self._policies = {}
+        self._CRUD = {'Get': [], 'Post': [], 'Put': [], 'Delete': []}
+        self._stats = {}
+        self._stats_lock = threading.Lock()
 
     def RegisterHandlers(self, crud_type, handlers):
         """Register CRUD request/response handler.
@@ -144,11 +2235,177 @@ class CroukeClient(object):
                       is called.
                       When error encountered, the handler
                       needs to raise excepts.RequestHandlingError error.
+                      A handler with a true local attribute answers from
+                      local state and is called without the request policy.
         """
         if not isinstance(handlers, (list, tuple)):
-            self._CRUD[crud_type].append(handlers)
+            handlers = [handlers]
+        for handler in handlers:
+            self._CRUD[crud_type].append(handler)
+            self._stats[handler] = _HandlerStats()
+
+    def RegisterTiers(self, handler, memory_size=_MEMORY_TIER_SIZE,
+                      directory=None, ttl=_TIER_TTL):
+        """Register a memory, an optional disk and a network Get tier.
+
+        Args:
+            handler: the network handler, e.g. a DefaultCRUDHandler.
+            memory_size: how many feeds the memory tier keeps.
+            directory: where the disk tier stores feeds. No disk tier is
+                       registered when it is None.
+            ttl: seconds the memory and disk tiers keep a feed for.
+        """
+        server = getattr(handler, '_server', None)
+        headers = getattr(handler, '_headers', None)
+        tiers = [MemoryTier(server, memory_size, ttl, headers)]
+        if directory:
+            tiers.append(DiskTier(directory, server, ttl, headers))
+        tiers.append(handler)
+        self.RegisterHandlers('Get', tiers)
+
+    def Prune(self):
+        """Evict old entries from every handler that provides Prune.
+
+        The disk tier and the HTTPCache grow with every new feed, so this
+        is meant to be called now and then, e.g. once per session.
+
+        Returns:
+            The number of entries deleted.
+        """
+        deleted = 0
+        for handlers in self._CRUD.itervalues():
+            for handler in handlers:
+                if hasattr(handler, 'Prune'):
+                    deleted += handler.Prune()
+        return deleted
+
+    def GetHandlerStats(self, crud_type='Get'):
+        """Return the counters of every handler of a CRUD type.
+
+        Args:
+            crud_type: 'Get', 'Post', 'Put', or 'Delete'
+
+        Returns:
+            A list of (handler, stats dict) tuples in chain order. The
+            stats dict has the hits, misses, errors, latency and
+            average_latency keys, latencies being in seconds.
+        """
+        self._stats_lock.acquire()
+        try:
+            return [(h, self._stats[h].AsDict())
+                    for h in self._CRUD[crud_type]]
+        finally:
+            self._stats_lock.release()
+
+    def _Record(self, handler, outcome, latency):
+        """Count a handler call in the handler stats."""
+        self._stats_lock.acquire()
+        try:
+            stats = self._stats[handler]
+            setattr(stats, outcome, getattr(stats, outcome) + 1)
+            stats.latency += latency
+        finally:
+            self._stats_lock.release()
+
+    def SetPolicy(self, crud_type, policy):
+        """Set how the requests of a CRUD type are retried and timed out.
+
+        Args:
+            crud_type: 'Get', 'Post', 'Put', or 'Delete'
+            policy: a RequestPolicy object, or None to call the handlers
+                    once without a deadline.
+        """
+        self._policies[crud_type] = policy
+
+    def _Call(self, crud_type, handler, url, *args, **kws):
+        """Call a handler method under the policy of the CRUD type.
+
+        A Get is retried and hedged by the policy unless the idempotent
+        keyword arg is False, e.g. for a request with side effects. The arg
+        is handed on to the handler, which must not send such a request
+        twice either.
+        """
+        func = getattr(handler, crud_type)
+        policy = self._policies.get(crud_type)
+        idempotent = kws.get('idempotent', crud_type == 'Get')
+        start = time.time()
+        try:
+            if not policy or getattr(handler, 'local', False):
+                result = func(url, *args, **kws)
+            else:
+                result = policy.Call(func, (url,) + args, kws,
+                                     idempotent=idempotent)
+        except excepts.RequestHandlingError:
+            self._Record(handler, 'errors', time.time() - start)
+            raise
+        if result is None:
+            self._Record(handler, 'misses', time.time() - start)
+        else:
+            self._Record(handler, 'hits', time.time() - start)
+        return result
+
+    def _Promote(self, handlers, url, result, args, kws):
+        """Store a result back into the handlers that provide Store."""
+        for handler in handlers:
+            if hasattr(handler, 'Store'):
+                handler.Store(url, result, *args, **kws)
+
+    def _Log(self, error):
+        """Log a handler error."""
+        if self._logger:
+            self._logger.log(error)
         else:
-            self._CRUD[crud_type].extend(handlers)
+            print >> sys.stderr, error
+
+    def GetMany(self, urls, *args, **kws):
+        """Retrieve many content feeds at once.
+
+        Every handler of the Get chain is asked for the feeds the handlers
+        before it did not return. Handlers providing GetMany get them all
+        in one call, and then the feeds they could not retrieve one by one
+        through Get. The other handlers are asked through Get only.
+
+        Args:
+            urls: a list of urls for the content feeds.
+            args: extra args.
+            kws: extra keyword args.
+                 fresh: boolean whether to skip the local handlers, see
+                        Get.
+
+        Returns:
+            A list of what the handlers return, in the order of urls.
+        """
+        fresh = kws.pop('fresh', False)
+        results = [None] * len(urls)
+        chain = self._CRUD['Get']
+        for index, handler in enumerate(chain):
+            missing = [i for i, r in enumerate(results) if r is None]
+            if not missing:
+                break
+            if fresh and getattr(handler, 'local', False):
+                continue
+            found = [None] * len(missing)
+            if hasattr(handler, 'GetMany'):
+                start = time.time()
+                try:
+                    found = handler.GetMany([urls[i] for i in missing],
+                                            *args, **kws)
+                except excepts.RequestHandlingError, e:
+                    self._Log(e)
+                    self._Record(handler, 'errors', time.time() - start)
+                else:
+                    self._Record(handler, 'hits', time.time() - start)
+            for n, i in enumerate(missing):
+                if found[n] is None:
+                    try:
+                        found[n] = self._Call('Get', handler, urls[i],
+                                              *args, **kws)
+                    except excepts.RequestHandlingError, e:
+                        self._Log(e)
+                if found[n] is not None:
+                    results[i] = found[n]
+                    self._Promote(chain[:index], urls[i], found[n], args, kws)
+        return results
 
     def RegisterLogHandler(self, logger):
         """Register a logging facility.
@@ -165,20 +2422,54 @@ class CroukeClient(object):
             url: the url for the content feed.
             args: extra args.
             kws: extra keyword args.
+                 fresh: boolean whether to skip the local handlers, e.g.
+                        when the feed is known to have changed. What the
+                        other handlers return is still stored in them.
+                 idempotent: boolean whether the request may be retried,
+                             hedged or sent again over a fresh connection.
+                             Default is True.
 
         Returns:
             The actual handler returns.
         """
-        for handler in self._CRUD['Get']:
+        fresh = kws.pop('fresh', False)
+        chain = self._CRUD['Get']
+        for index, handler in enumerate(chain):
+            if fresh and getattr(handler, 'local', False):
+                continue
             try:
-                resp = handler.Get(url, *args, **kws)
+                resp = self._Call('Get', handler, url, *args, **kws)
             except excepts.RequestHandlingError, e:
-                if self._logger:
-                    self._logger.log(e)
-                else:
-                    print >> sys.stderr, e
+                self._Log(e)
             else:
-                return resp
+                if resp is not None:
+                    self._Promote(chain[:index], url, resp, args, kws)
+                    return resp
+
+    def GetLocal(self, url, *args, **kws):
+        """Retrieve a content feed from the local Get handlers only.
+
+        Only the handlers with a true local attribute, e.g. the memory and
+        disk tiers, are asked, so no request goes out.
+
+        Args:
+            url: the url for the content feed.
+            args: extra args.
+            kws: extra keyword args.
+
+        Returns:
+            What the first local handler having the feed returns, or None.
+        """
+        chain = [h for h in self._CRUD['Get'] if getattr(h, 'local', False)]
+        for index, handler in enumerate(chain):
+            try:
+                resp = self._Call('Get', handler, url, *args, **kws)
+            except excepts.RequestHandlingError, e:
+                self._Log(e)
+            else:
+                if resp is not None:
+                    self._Promote(chain[:index], url, resp, args, kws)
+                    return resp
 
     def Post(self, url, *args, **kws):
         """Post the content feed to a given url.
@@ -193,7 +2484,7 @@ class CroukeClient(object):
         """
         for handler in self._CRUD['Post']:
             try:
-                resp = handler.Post(url, *args, **kws)
+                resp = self._Call('Post', handler, url, *args, **kws)
             except excepts.RequestHandlingError, e:
                 if self._logger:
                     self._logger.log(e)
@@ -215,7 +2506,7 @@ class CroukeClient(object):
         """
         for handler in self._CRUD['Put']:
             try:
-                resp = handler.Put(url, *args, **kws)
+                resp = self._Call('Put', handler, url, *args, **kws)
             except excepts.RequestHandlingError, e:
                 if self._logger:
                     self._logger.log(e)
@@ -237,7 +2528,7 @@ class CroukeClient(object):
         """
         for handler in self._CRUD['Delete']:
             try:
-                resp = handler.Delete(url, *args, **kws)
+                resp = self._Call('Delete', handler, url, *args, **kws)
             except excepts.RequestHandlingError, e:
                 if self._logger:
                     self._logger.log(e)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+"""Provide a columnar container for the entries of LIST feeds.
+"""
+
+from array import array
+import heapq
+import sys
+
+from objectifyxml import Intern
+
+# the fields of a list entry, in the order a Listing takes them.
+FIELDS = ('id', 'changed', 'name', 'score', 'downloads')
+
+# sort mode -> (column, descending) Listing.Order sorts by. 'new' is oldest
+# first, as Crouke.GetListId has always sorted it, the reverse of the order
+# the sites list entries in.
+_SORT_KEYS = {'new': ('changed', False),
+              'alpha': ('names', False),
+              'high': ('scores', True),
+              'down': ('downloads', True)}
+
+# sort mode -> key of an (id, changed, name, score, downloads) entry, in
+# the order the sites list entries in, which Merge has to follow. 'new' is
+# newest first here, unlike in _SORT_KEYS.
+_MERGE_KEYS = {'new': lambda e: -_Number(e[1]),
+               'alpha': lambda e: e[2],
+               'high': lambda e: -_Number(e[3]),
+               'down': lambda e: -_Number(e[4])}
+
+# typecode of every numeric column.
+_COLUMNS = (('ids', 'l'), ('changed', 'l'), ('scores', 'l'),
+            ('downloads', 'l'))
+
+
+def _Number(value):
+    """Return a numeric field of a list entry, 0 if it is not one.
+
+    Args:
+        value: the field text as the feed has it.
+    """
+    try:
+        number = long(value)
+    except (TypeError, ValueError):
+        return 0
+    if not -sys.maxint - 1 <= number <= sys.maxint:
+        # it would not fit the array columns.
+        return 0
+    return number
+
+
+class Listing(object):
+    """Keep LIST entries as typed columns instead of one tuple per entry.
+
+    The ids, changed timestamps, scores and download counts are kept in
+    arrays of machine integers, the names in a list of shared strings,
+    so that a few hundred thousand entries stay cheap to hold and sort.
+    """
+
+    __slots__ = ('ids', 'changed', 'names', 'scores', 'downloads')
+
+    def __init__(self, entries=()):
+        """Constructor to init the object.
+
+        Args:
+            entries: iterable of (id, changed, name, score, downloads)
+                tuples, e.g. the output of Crouke.IterListEntries.
+        """
+        for name, code in _COLUMNS:
+            setattr(self, name, array(code))
+        self.names = []
+        self.Extend(entries)
+
+    def Extend(self, entries):
+        """Append entries, e.g. the next page of a list.
+
+        Args:
+            entries: iterable of (id, changed, name, score, downloads)
+                tuples. Missing or malformed numeric fields count as 0.
+        """
+        ids, changed, scores = self.ids, self.changed, self.scores
+        downloads, names = self.downloads, self.names
+        for id_, stamp, name, score, down in entries:
+            ids.append(_Number(id_))
+            changed.append(_Number(stamp))
+            scores.append(_Number(score))
+            downloads.append(_Number(down))
+            names.append(Intern(name))
+
+    def Order(self, sortmode):
+        """Compute the permutation which sorts the entries by sort mode.
+
+        The sort is stable, entries with equal keys keep their list order.
+        'new' sorts the oldest entries first, the reverse of the order the
+        sites list them in and Merge yields them in.
+
+        Args:
+            sortmode: one of the LIST sort modes; an unknown one keeps
+                the list order.
+
+        Returns:
+            An array of entry indexes.
+        """
+        order = array('l', xrange(len(self.ids)))
+        if sortmode not in _SORT_KEYS:
+            return order
+        column, descending = _SORT_KEYS[sortmode]
+        column = getattr(self, column)
+        if isinstance(column, array):
+            # indexing a list hands out the existing int objects, indexing
+            # the array would box a new one per comparison key.
+            column = column.tolist()
+        return array('l', sorted(order, key=column.__getitem__,
+                                 reverse=descending))
+
+    def Where(self, column, low=None, high=None):
+        """Compute the indexes of the entries with a column in a range.
+
+        Args:
+            column: 'changed', 'scores' or 'downloads'.
+            low: the smallest value to keep, None for no bound.
+            high: the largest value to keep, None for no bound.
+
+        Returns:
+            An array of entry indexes in list order.
+        """
+        values = getattr(self, column)
+        return array('l', [i for i, value in enumerate(values)
+                           if (low is None or value >= low) and
+                           (high is None or value <= high)])
+
+    def Take(self, indexes):
+        """Build a new listing from the entries at the given indexes.
+
+        Args:
+            indexes: iterable of entry indexes, e.g. from Order or Where.
+
+        Returns:
+            A Listing object.
+        """
+        lst = Listing()
+        for name, code in _COLUMNS:
+            column = getattr(self, name)
+            setattr(lst, name, array(code, [column[i] for i in indexes]))
+        names = self.names
+        lst.names = [names[i] for i in indexes]
+        return lst
+
+    def Sort(self, sortmode):
+        """Return a new listing sorted by the given sort mode."""
+        return self.Take(self.Order(sortmode))
+
+    def Filter(self, column, low=None, high=None):
+        """Return a new listing of the entries with a column in a range."""
+        return self.Take(self.Where(column, low, high))
+
+    def GetIds(self, indexes=None):
+        """Retrieve the content ids.
+
+        Args:
+            indexes: iterable of entry indexes, e.g. from Order or Where;
+                None for all entries in listing order.
+
+        Returns:
+            A list of content id strings.
+        """
+        if indexes is None:
+            return [str(i) for i in self.ids]
+        ids = self.ids
+        return [str(ids[i]) for i in indexes]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return (str(self.ids[index]), str(self.changed[index]),
+                self.names[index], str(self.scores[index]),
+                str(self.downloads[index]))
+
+    def __iter__(self):
+        for i in xrange(len(self.ids)):
+            yield self[i]
+
+
+def Merge(streams, sortmode):
+    """Merge sorted streams of list entries into one sorted stream.
+
+    Each stream is read only as far as the merged stream is, so a stream
+    backed by a paged list fetches its next page only once it is needed.
+    Entries with equal keys come in the order of the streams. The merged
+    stream is in the order the sites list entries in, so 'new' yields the
+    newest entries first, the reverse of Listing.Order.
+
+    Args:
+        streams: a list of iterables of (id, changed, name, score,
+                 downloads) tuples, each in the order the sites list them
+                 for sortmode.
+        sortmode: one of the LIST sort modes; an unknown one gives the
+                  streams one after another.
+
+    Yields:
+        (stream index, entry) tuples.
+    """
+    key = _MERGE_KEYS.get(sortmode, lambda e: 0)
+    heap = []
+    for index, stream in enumerate(streams):
+        it = iter(stream)
+        for entry in it:
+            heap.append((key(entry), index, entry, it))
+            break
+    heapq.heapify(heap)
+    while heap:
+        k, index, entry, it = heap[0]
+        yield index, entry
+        for entry in it:
+            heapq.heapreplace(heap, (key(entry), index, entry, it))
+            break
+        else:
+            heapq.heappop(heap)
@@ -4,15 +4,60 @@
 """
 
 import __builtin__ as _
+import collections
+import hashlib
+import StringIO
+import threading
+import urllib
+import weakref
 try:
     from xml.etree import cElementTree as tree
 except ImportError:
     import elementtree as tree
 
+# Tags of the OCS feeds that are known to hold nothing but text. Their
+# objects get a fixed __slots__ layout instead of a __dict__.
+_TEXT_TAGS = frozenset([
+    'id', 'name', 'changed', 'created', 'score', 'downloads', 'status',
+    'message', 'statuscode', 'totalitems', 'itemsperpage', 'personid',
+    'profilepage', 'version', 'description', 'changelog', 'license',
+    'licensetype', 'language', 'homepage', 'homepagetype', 'typeid',
+    'typename', 'comments', 'fans', 'detailpage', 'preview1', 'preview2',
+    'preview3', 'previewpic1', 'previewpic2', 'previewpic3',
+    'smallpreviewpic1', 'smallpreviewpic2', 'smallpreviewpic3',
+    'downloadlink1', 'downloadname1', 'downloadsize1', 'downloadtype1',
+    'downloadprice1', 'downloadway1', 'depend', 'text'])
+
+# Tags whose text repeats across entries, feeds and sites, e.g. licenses
+# and language codes. Their objects share the text through the
+# InternTable, and so do the content dicts of ContentDecoder.
+SHARED_TAGS = frozenset([
+    'status', 'statuscode', 'message', 'itemsperpage', 'license',
+    'licensetype', 'language', 'typeid', 'typename', 'personid',
+    'homepagetype', 'downloadtype1', 'downloadprice1', 'downloadway1'])
+
+# body bytes a ParseMemo keeps by default.
+_MEMO_BYTES = 8 << 20
+
+# tag name -> class, filled in by _GetClass.
+_classes = {}
+_slotted_classes = {}
+
+# Guards the lazy wrapping of child elements, so that threads reading the
+# same feed wrap each child once and all see it.
+_lazy_lock = threading.Lock()
+
+
 class __BASE__(object):
     """A base meta class where all elements will be built from.
+
+    In lazy mode the child elements are only wrapped into objects the first
+    time their attribute is looked up, which saves building objects for the
+    parts of a feed nobody reads.
     """
 
+    __slots__ = ('__treedata', '_args', '_kws', '__lazy', '__pending')
+
     def __init__(self, data, *args, **kws):
         """Constructor to init the object.
 
@@ -20,13 +65,18 @@ class __BASE__(object):
             data: the xml element data.
             args: extra args.
             kws: extra kws.
+                 lazy: boolean whether to wrap the child elements on first
+                       access. Default is False.
         """
         self.__treedata = data
         self._args = args
         self._kws = kws
+        self.__lazy = kws.get('lazy', False)
+        # tag -> child elements not wrapped yet, built on first access.
+        self.__pending = None
 
         children = self.__treedata.getchildren()
-        if children:
+        if children and not self.__lazy:
             for c in children:
                 if c.tag in self:
                     if not isinstance(getattr(self, c.tag), list):
@@ -41,8 +91,50 @@ class __BASE__(object):
             for a in self.__treedata.attrib:
                 setattr(self, a, self.__treedata.get(a))
 
-        if self.__treedata.text:
-            self.text = self.__treedata.text
+        text = self.__treedata.text
+        if text:
+            if self.__treedata.tag in SHARED_TAGS:
+                # the element gives up its copy of the text as well.
+                text = self.__treedata.text = _interned.Intern(text)
+            self.text = text
+
+    def __getattr__(self, name):
+        """Wrap the child elements of a tag on first access in lazy mode.
+
+        Only called when the normal attribute lookup fails. Thread-safe.
+        """
+        if name.startswith('_') or not self.__lazy:
+            raise AttributeError(name)
+        _lazy_lock.acquire()
+        try:
+            if self.__pending is None:
+                pending = {}
+                wrapped = getattr(self, '__dict__', {})
+                for c in self.__treedata.getchildren():
+                    if c.tag not in wrapped:
+                        pending.setdefault(c.tag, []).append(c)
+                self.__pending = pending
+            elements = self.__pending.get(name)
+            if elements is None:
+                # another thread may have wrapped it since the lookup
+                # failed.
+                return object.__getattribute__(self, name)
+            objs = [_GetObj(name, c, lazy=True) for c in elements]
+            if len(objs) == 1:
+                value = objs[0]
+            else:
+                value = objs
+            setattr(self, name, value)
+            self.__pending.pop(name, None)
+            return value
+        finally:
+            _lazy_lock.release()
+
+    def _Materialize(self):
+        """Wrap every child element not wrapped yet."""
+        if self.__lazy:
+            for c in self.__treedata.getchildren():
+                getattr(self, c.tag, None)
 
     def __repr__(self):
         """Return the object representation form.
@@ -67,8 +159,12 @@ class __BASE__(object):
     def __iter__(self):
         """Construct an iterator for this object.
         """
-        return (v for k, v in self.__dict__.iteritems() 
-                if not k.startswith('_'))
+        self._Materialize()
+        items = getattr(self, '__dict__', {}).items()
+        for name in self.__class__.__dict__.get('__slots__', ()):
+            if hasattr(self, name):
+                items.append((name, getattr(self, name)))
+        return (v for k, v in items if not k.startswith('_'))
     
     def GetElementData(self):
         """Return the underlie elementtree object.
@@ -80,23 +176,108 @@ class ContentParser(object):
     """The content data parser class.
     """
 
-    def __init__(self, content, category):
+    def __init__(self, content, category, lazy=False, memo=None, digest=None):
         """Constructor to init the object.
 
         Args:
-            content: the content xml string.
+            content: the content xml string, or an iterable of xml string
+                     chunks which are parsed as they come.
             category: the category type of this content.
+            lazy: boolean whether the objects wrap their child elements
+                  on first access.
+            memo: optional ParseMemo. When given, a body parsed before is
+                  not parsed again and the earlier result is returned, so
+                  the result must be treated as read-only.
+            digest: optional (size, md5 digest) the caller took of the body
+                    as it came, so the memo is looked up before the chunks
+                    are parsed. See DigestChunks.
         """
         self._content = content
         self._category = category
+        self._lazy = lazy
+        self._memo = memo
+        self._digest = digest
+
+    def parse(self):
+        """Parse the xml string into an elementtree element."""
+        if isinstance(self._content, basestring):
+            return tree.fromstring(self._content)
+        parser = tree.XMLParser()
+        for chunk in self._content:
+            parser.feed(chunk)
+        return parser.close()
 
     def objectify(self):
         """Convert the xml string to a python object.
         
         The actual implementation is done by _objectify.
         """
-        element = tree.fromstring(self._content)
-        return self._objectify(element)
+        return self._Memoized(self._objectify, self._lazy)
+
+    def project(self, projector):
+        """Decode only the fields a projector asks for.
+
+        Args:
+            projector: a FieldProjector object.
+
+        Returns:
+            What projector.Project returns.
+        """
+        return self._Memoized(projector.Project, projector)
+
+    def _Memoized(self, convert, variant):
+        """Parse and convert the content, through the memo if there is one.
+
+        Args:
+            convert: a callable converting the root element.
+            variant: what tells different conversions of a body apart.
+
+        Returns:
+            What convert returns.
+        """
+        if self._memo is None:
+            return convert(self.parse())
+        element = None
+        digest = self._digest
+        if digest is None:
+            if isinstance(self._content, basestring):
+                # a whole body is looked up before it is parsed.
+                digest = DigestChunks([self._content])
+            else:
+                # chunks nobody digested are digested as they are parsed,
+                # so the body is never held in one piece.
+                md5 = hashlib.md5()
+                element, size = self._Feed(md5)
+                digest = (size, md5.digest())
+        key = (digest, self._category, variant)
+        result = self._memo.Get(key)
+        if result is None:
+            if element is None:
+                element, size = self._Feed()
+            result = convert(element)
+            self._memo.Set(key, result, size)
+        return result
+
+    def _Feed(self, md5=None):
+        """Parse the content, counting its size.
+
+        Args:
+            md5: optional hashlib md5 object the content is fed to as well.
+
+        Returns:
+            A tuple of the root element and the content size.
+        """
+        chunks = self._content
+        if isinstance(chunks, basestring):
+            chunks = [chunks]
+        size = 0
+        parser = tree.XMLParser()
+        for chunk in chunks:
+            size += len(chunk)
+            if md5 is not None:
+                md5.update(chunk)
+            parser.feed(chunk)
+        return parser.close(), size
 
     def _objectify(self, element):
         """Do the object convertion.
@@ -104,19 +285,480 @@ class ContentParser(object):
         Args:
             element: an elementtree element.
         """
-        return _GetObj(self._category, element)
+        return _GetObj(self._category, element, lazy=self._lazy)
+
+
+class FieldProjector(object):
+    """Decode a fixed set of fields of a feed into tuples.
+
+    The field values are read straight from the elementtree, no python
+    object is built for the elements, which makes it several times faster
+    than objectify for callers that only need a few flat fields.
+
+    Projectors compare equal when they project the same fields, so they
+    can be part of cache keys.
+    """
+
+    def __init__(self, fields, path='data/entry'):
+        """Constructor to init the object.
+
+        Args:
+            fields: a sequence of field paths relative to a record, e.g.
+                    ('id', 'changed', 'name', 'score', 'downloads').
+            path: the path of the records relative to the feed root.
+        """
+        self._fields = tuple(fields)
+        self._path = path
+
+    def ProjectRecord(self, element):
+        """Return the field values of one record element as a tuple.
+
+        A missing field gives None, an empty one ''.
+        """
+        return tuple([element.findtext(f) for f in self._fields])
+
+    def Project(self, element):
+        """Decode a feed.
+
+        Args:
+            element: the feed root element.
+
+        Returns:
+            A tuple of (status text, tuple of field value tuples).
+        """
+        return (element.findtext('status'),
+                tuple([self.ProjectRecord(e)
+                       for e in element.iterfind(self._path)]))
+
+    def _Key(self):
+        return (self._fields, self._path)
+
+    def __eq__(self, other):
+        return (isinstance(other, FieldProjector) and
+                self._Key() == other._Key())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._Key())
+
+    def __repr__(self):
+        return 'FieldProjector(%r, %r)' % self._Key()
+
+
+class DictDecoder(object):
+    """Decode a feed into plain dicts, lists and strings.
+
+    An element with children becomes a dict of child tag to value, a tag
+    that repeats becomes a list, any other element becomes its text. The
+    result only holds builtin types, so it pickles cheaply, e.g. to pass
+    it back from another process. It has the decoder interface of
+    FieldProjector and all DictDecoders compare equal.
+    """
+
+    def Project(self, element):
+        """Decode a feed.
+
+        Args:
+            element: the feed root element.
+
+        Returns:
+            A dict of the children of the feed root.
+        """
+        return _ToDict(element)
+
+    def __eq__(self, other):
+        return isinstance(other, DictDecoder)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(DictDecoder)
+
+    def __repr__(self):
+        return 'DictDecoder()'
+
+
+class ContentDecoder(object):
+    """Decode content feeds into content dicts.
+
+    The fields of a content are laid out by a plan which is computed once
+    per content schema, i.e. per sequence of tags under data, and reused
+    for every content of that schema. Values without a '%' are not
+    unquoted, and the values of the SHARED_TAGS fields are
+    shared between the contents through Intern. It has the
+    decoder interface of FieldProjector, so it can be handed
+    to the client as decoder.
+
+    The client memoizes and caches what a decoder returns, so the dicts
+    may be handed to many callers; presentation.Crouke gives out copies of
+    them.
+    """
+
+    def __init__(self):
+        """Constructor to init the object."""
+        # schema -> (keys, list of (key, child index, interned)).
+        self._plans = {}
+
+    def Project(self, element):
+        """Decode a content feed.
+
+        Args:
+            element: the feed root element.
+
+        Returns:
+            A dict reprsenting a content, empty when the status is not ok.
+        """
+        return self.DecodeBatch([element])[0]
+
+    def DecodeBatch(self, elements):
+        """Decode many content feeds.
+
+        Args:
+            elements: a list of feed root elements.
+
+        Returns:
+            A list of dicts reprsenting the contents, in the same order.
+        """
+        plans = self._plans
+        intern = Intern
+        contents = []
+        for element in elements:
+            data = element.find('data')
+            if element.findtext('status') != 'ok' or data is None:
+                contents.append({})
+                continue
+            children = data.getchildren()
+            schema = tuple([c.tag for c in data.getiterator()])
+            plan = plans.get(schema)
+            if plan is None:
+                plan = plans.setdefault(schema, self._Plan(schema, children))
+            keys, fields = plan
+            content = dict.fromkeys(keys)
+            for key, index, interned in fields:
+                text = children[index].text
+                if not text:
+                    continue
+                if '%' in text:
+                    text = urllib.unquote(text)
+                if not isinstance(text, unicode):
+                    text = unicode(text, 'utf-8', 'ignore')
+                if interned:
+                    text = intern(text)
+                content[key] = text
+            contents.append(content)
+        return contents
+
+    def _Plan(self, schema, children):
+        """Compute the field plan of a content schema.
+
+        Every tag under data becomes a key of the content, but only the
+        children occurring once get a value.
+
+        Args:
+            schema: the tags under data, data itself first.
+            children: the child elements of data.
+
+        Returns:
+            A tuple of (keys, list of (key, child index, interned)).
+        """
+        counts = {}
+        for c in children:
+            counts[c.tag] = counts.get(c.tag, 0) + 1
+        fields = [(c.tag, i, c.tag in SHARED_TAGS)
+                  for i, c in enumerate(children) if counts[c.tag] == 1]
+        return (schema[1:], fields)
+
+    def __getstate__(self):
+        # the plans are rebuilt wherever the decoder goes.
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def __eq__(self, other):
+        return isinstance(other, ContentDecoder)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(ContentDecoder)
+
+    def __repr__(self):
+        return 'ContentDecoder()'
+
+
+class _SharedText(unicode):
+    """A unicode string the InternTable can hold a weak reference to."""
+
+    __slots__ = ('__weakref__',)
+
+    def __reduce__(self):
+        # pickled as a plain unicode string.
+        return (unicode, (unicode(self),))
+
+
+class InternTable(object):
+    """Share equal strings between the parsed feeds.
+
+    A str is interned with the builtin intern, whose table drops strings
+    nobody else refers to. A unicode string is replaced by a shared copy
+    which the table only holds a weak reference to, so the table shrinks
+    again once the feeds holding a value are gone.
+
+    Thread-safe.
+    """
+
+    def __init__(self):
+        """Constructor to init the object."""
+        # unicode value -> its shared copy.
+        self._unicode = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def Intern(self, value):
+        """Return the shared string equal to value.
+
+        Args:
+            value: a str or unicode string. Anything else is returned as
+                   it is.
+        """
+        if type(value) is str:
+            return _.intern(value)
+        if type(value) is not unicode:
+            return value
+        self._lock.acquire()
+        try:
+            shared = self._unicode.get(value)
+            if shared is None:
+                shared = _SharedText(value)
+                self._unicode[value] = shared
+            return shared
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        """Return the number of shared unicode strings."""
+        return len(self._unicode)
+
+
+_interned = InternTable()
+
+
+def Intern(value):
+    """Return the shared string equal to value, see InternTable.Intern."""
+    return _interned.Intern(value)
+
+
+def DigestChunks(chunks, encoding=None):
+    """Digest a body the way ParseMemo results are keyed on.
+
+    Args:
+        chunks: an iterable of the body string chunks.
+        encoding: optional Content-Encoding the chunks are sent with.
+
+    Returns:
+        A tuple of the body size and its md5 digest.
+    """
+    # a body without an encoding digests the same as its text.
+    md5 = hashlib.md5((encoding or '').strip().lower())
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        md5.update(chunk)
+    return size, md5.digest()
+
+
+class ParseMemo(object):
+    """A memo of parse results keyed by a digest of the parsed body.
+
+    Pollers refetch feeds which did not change, and servers often ignore
+    conditional GETs, so the same bytes come in again and again. The memo
+    hands out the earlier result for them instead of parsing again. It is
+    bounded by the summed size of the bodies and evicts the least recently
+    used results first.
+    """
+
+    def __init__(self, max_bytes=_MEMO_BYTES):
+        """Constructor to init the object.
+
+        Args:
+            max_bytes: how many body bytes the memo accounts for at most.
+        """
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        # key -> (result, size), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def Get(self, key):
+        """Return the result memoized for key, or None."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries[key] = entry
+            self._hits += 1
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def Set(self, key, result, size):
+        """Memoize a result.
+
+        Args:
+            key: the memo key.
+            result: the parse result.
+            size: the size of the body the result was parsed from.
+        """
+        if size > self._max_bytes:
+            return
+        self._lock.acquire()
+        try:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+        finally:
+            self._lock.release()
+
+    def Clear(self):
+        """Drop all memoized results."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    def GetStats(self):
+        """Return a dict of the hits, misses, entries and bytes held."""
+        self._lock.acquire()
+        try:
+            return {'hits': self._hits, 'misses': self._misses,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+        finally:
+            self._lock.release()
+
+
+class EntryStream(object):
+    """Parse a feed incrementally and yield its entries as they complete.
+
+    Each entry is objectified as soon as its end tag is parsed and is then
+    detached from the document, so the parsed tree does not grow with the
+    number of entries. The feed status text is available as status once
+    the first entry comes, since the status precedes the data.
+    """
+
+    def __init__(self, source, tag='entry', lazy=False, fields=None):
+        """Constructor to init the object.
+
+        Args:
+            source: a file like object, or the content xml string.
+            tag: the tag name of the entries.
+            lazy: boolean whether the entry objects wrap their child
+                  elements on first access.
+            fields: optional sequence of field paths. When given, tuples of
+                    the field values are yielded instead of entry objects.
+        """
+        if isinstance(source, basestring):
+            source = StringIO.StringIO(source)
+        self._source = source
+        self._tag = tag
+        self._lazy = lazy
+        self._projector = None
+        if fields:
+            self._projector = FieldProjector(fields)
+        self.status = None
+
+    def __iter__(self):
+        """Yield the entry objects, or field tuples, in document order."""
+        parents = []
+        for event, element in tree.iterparse(self._source,
+                                             events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag == self._tag:
+                if self._projector:
+                    entry = self._projector.ProjectRecord(element)
+                else:
+                    entry = _GetObj(element.tag, element, lazy=self._lazy)
+                if parents:
+                    parents[-1].remove(element)
+                yield entry
+            elif element.tag == 'status' and len(parents) == 1:
+                self.status = element.text
+
+
+def _GetClass(tagname, slotted):
+    """Return the class objects of a tag are built from.
+
+    Classes are made once per tag name and kept in a registry, so tag names
+    never clash with module globals.
+
+    Args:
+        tagname: the tagname of the element.
+        slotted: boolean whether the class stores only the text, in a
+                 __slots__ layout.
+    """
+    if slotted:
+        registry = _slotted_classes
+        attrs = {'__slots__': ('text',)}
+    else:
+        registry = _classes
+        attrs = {}
+    cls = registry.get(tagname)
+    if cls is None:
+        if isinstance(tagname, unicode):
+            name = tagname.encode('utf-8')
+        else:
+            name = tagname
+        cls = registry.setdefault(tagname, type(name, (__BASE__,), attrs))
+    return cls
+
+
+def _ToDict(element):
+    """Convert an element into plain dicts, lists and strings.
+
+    Args:
+        element: the elementtree object.
+    """
+    if not len(element):
+        return element.text
+    result = {}
+    for child in element:
+        value = _ToDict(child)
+        if child.tag not in result:
+            result[child.tag] = value
+        elif isinstance(result[child.tag], list):
+            result[child.tag].append(value)
+        else:
+            result[child.tag] = [result[child.tag], value]
+    return result
 
 
-def _GetObj(tagname, src):
+def _GetObj(tagname, src, **kws):
     """Construct a python object by giving the element tree object.
 
     Args:
         tagname: the tagname of the element. Used to 
                  form the object's attribute.
         src: the elementtree object.
+        kws: extra kws passed to the object.
     """
-    try:
-        return globals()[tagname](src)
-    except KeyError:
-        exec 'class %s(__BASE__): pass' % tagname in globals()
-        return globals()[tagname](src)
+    if tagname in _TEXT_TAGS and not src.attrib and not len(src):
+        cls = _slotted_classes.get(tagname) or _GetClass(tagname, True)
+    else:
+        cls = _classes.get(tagname) or _GetClass(tagname, False)
+    return cls(src, **kws)
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 
 # system library
-import urllib
+import itertools
+import os
+import Queue
+import threading
+import time
 
 # temporary for development environment
 # should be configured to use python-support pth in release
@@ -16,6 +20,9 @@ import excepts
 
 # the server list will be read from file
 import client
+import listing
+import objectifyxml
+import store
 
 _METHODS = {'CATEGORY' : '/V1/CATEGORIES/',
             'LIST' : '/V1/LIST/%s/%s/%s',
@@ -24,6 +31,38 @@ _METHODS = {'CATEGORY' : '/V1/CATEGORIES/',
 _SORTMODE = ['new', 'alpha', 'high', 'down' ]
 _VOTES = ['good', 'bad']
 _CATEGORY_SEPARATER = 'x'
+_HTTP_CACHE_DIR = os.path.join(settings.CROUKE_USER_SYS, 'httpcache')
+_FEED_CACHE_DIR = os.path.join(settings.CROUKE_USER_SYS, 'feeds')
+_STORE_PATH = os.path.join(settings.CROUKE_USER_SYS, 'store.db')
+# seconds an expired record is still kept in the store, as the fallback
+# for when a site can not be reached.
+_STORE_PURGE_GRACE = 30 * 86400
+# seconds a Get may take, retries included, and the latency percentile
+# after which a Get is hedged.
+_GET_DEADLINE = 60
+_GET_HEDGE_PERCENTILE = 95
+# a fan-out runs this many workers, each getting its contents in pipelined
+# batches of this size; together they fill a connection pool.
+_FANOUT_WORKERS = 2
+_FANOUT_BATCH = 8
+# how many pages of the newest contents a sync reads at most.
+_SYNC_MAX_PAGES = 10
+# how many list pages of a site a SiteAggregator reads at most, and how
+# many of them it reads ahead of the merge.
+_AGGREGATE_MAX_PAGES = 50
+_AGGREGATE_READ_AHEAD = 1
+# entries on a page merged from all sites.
+_AGGREGATE_PAGE_SIZE = 20
+
+# set once this process pruned the caches and the store, see SetupClient.
+_pruned = threading.Event()
+# decodes the content feeds, shared so its plans are computed once.
+_CONTENT_DECODER = objectifyxml.ContentDecoder()
+
+
+def _CopyContent(content):
+    """Return a copy of a decoded content the caller may change."""
+    return dict(content)
 
 
 class Crouke(object):
@@ -46,6 +85,7 @@ class Crouke(object):
             self.AddNewSite(site)
         self._site = site
         self._client = None
+        self._store = None
         if self._user and self._password:
             self.SetupClient()
     
@@ -66,9 +106,34 @@ class Crouke(object):
         """Setup the Crouke client.
         """
         self._client = client.CroukeClient(self._user, self._password)
-        self._client.RegisterHandler('Get', client.DefaultCRUDHandler(
-                                     server=self._site,
-                                     headers=self._client._headers))
+        self._client.RegisterTiers(client.DefaultCRUDHandler(
+                                   server=self._site,
+                                   headers=self._client._headers,
+                                   cache=client.HTTPCache(_HTTP_CACHE_DIR)),
+                                   directory=_FEED_CACHE_DIR)
+        self._client.SetPolicy('Get', client.RequestPolicy(
+                               deadline=_GET_DEADLINE,
+                               hedge_percentile=_GET_HEDGE_PERCENTILE))
+        self._store = store.GetStore(_STORE_PATH)
+        if not _pruned.isSet():
+            # the caches are shared by every site, once a process will do.
+            _pruned.set()
+            self._client.Prune()
+            self._store.Purge(time.time() - _STORE_PURGE_GRACE)
+
+    def _Stored(self, kind, key, stale=False):
+        """Retrieve a record of this site from the local store.
+
+        See store.ContentStore.Get.
+        """
+        return self._store.Get(kind, self._site or '', key, stale)
+
+    def _Store(self, kind, records, ttl):
+        """Store records of this site in the local store.
+
+        See store.ContentStore.PutMany.
+        """
+        self._store.PutMany(kind, self._site or '', records, ttl)
     
     def ProgrammaticLogin(self):
         """Do Programmatic login test.
@@ -89,7 +154,9 @@ class Crouke(object):
         # just pick the first site to try login since these sites
         # are all share the login info.
         if not self._client: self.SetupClient()
-        retv = self._client.Get(_METHODS['CATEGORY'], server=settings.SITES[0])
+        # the credentials are checked by the server, never by the tiers.
+        retv = self._client.Get(_METHODS['CATEGORY'], server=settings.SITES[0],
+                                fresh=True)
         if not retv:
             return _.auth_failed
         else:
@@ -107,21 +174,37 @@ class Crouke(object):
     def GetCategory(self):
         """Retrieve a list of category.
 
+        The list is served from the local store while it is fresh, and
+        also when it is stale but the site can not be reached.
+
         Returns:
             A list of category with element of a tuple in (id, text) format.
         """
+        clist = self._Stored('category', '')
+        if clist is not None:
+            return clist
         # a list of two-element tuple ('id', 'name')
         clist = []
         retv = self._client.Get(_METHODS['CATEGORY'])
-        if retv and retv == 'ok':
-            clist = [(i.id, i.text) for i in retv.data.category]
+        if retv and retv.status.text == 'ok':
+            cates = retv.data.category
+            if not isinstance(cates, list):
+                cates = [cates]
+            clist = [(i.id.text, i.name.text) for i in cates]
             #clist.sort(key=lambda k: k[1])
+            self._Store('category', [('', clist, None)],
+                        settings.STORE_CATEGORY_TTL)
+        else:
+            clist = self._Stored('category', '', stale=True) or []
         return clist
 
     def GetListId(self, cat_id_list, sortmode=_SORTMODE[0], page=0):
         """Retrieve the content list ids by given category id list and the
         sort mode.
 
+        The ids are sorted by Listing.Order, so the 'new' mode gives the
+        oldest content first.
+
         Args:
             cat_id_list: category id list.
             sortmode: sorting mode.
@@ -130,24 +213,94 @@ class Crouke(object):
         Returns:
             A list of content ids.
         """
-        content_list_id = []
+        lst = self.GetListing(cat_id_list, sortmode=sortmode, page=page)
+        return lst.GetIds(lst.Order(sortmode))
+
+    def GetListing(self, cat_id_list, sortmode=_SORTMODE[0], page=0):
+        """Retrieve a page of the content list as a columnar listing.
+
+        Args:
+            cat_id_list: category id list.
+            sortmode: sorting mode.
+            page: which page to display.
+
+        Returns:
+            A listing.Listing object in list order; Extend it with further
+            pages and Sort or Filter it as needed.
+        """
+        uri = self._ListUri(cat_id_list, sortmode, page)
+        entries = self._Stored('list', uri)
+        if entries is None:
+            entries = list(self.IterListEntries(cat_id_list,
+                                                sortmode=sortmode,
+                                                page=page))
+            if entries:
+                changed = max([store.GetChanged(i[1]) for i in entries])
+                self._Store('list', [(uri, entries, changed)],
+                            settings.STORE_LIST_TTL)
+            else:
+                entries = self._Stored('list', uri, stale=True) or []
+        return listing.Listing(entries)
+
+    def _ListUri(self, cat_id_list, sortmode, page):
+        """Return the uri of a content list page."""
         cats = ''.join([i + _CATEGORY_SEPARATER
                         for i in cat_id_list]).strip(_CATEGORY_SEPARATER)
-        uri = _METHODS['LIST'] % (cats, sortmode, page)
-        lst = self._client.Get(uri)
-        if lst and lst.status.text == 'ok':
-            content_list_id = [(i.id.text, i.changed.text, i.name.text,
-                                i.score.text, i.downloads.text) 
-                               for i in lst.data.entry]
-            if sortmode == _SORTMODE[0]:
-                content_list_id.sort(key=lambda i: long(i[1]))
-            elif sortmode == _SORTMODE[1]:
-                content_list.sort(key=lambda i: i[2])
-            elif sortmode == _SORTMODE[2]:
-                content_list.sort(key=lambda i: int(i[3]), reverse=True)
-            elif sortmode == _SORTMODE[3]:
-                content_list.sort(key=lambda i: int(i[4]), reverse=True)
-        return [i[0] for i in content_list_id]
+        return _METHODS['LIST'] % (cats, sortmode, page)
+
+    def IterListEntries(self, cat_id_list, sortmode=_SORTMODE[0], page=0):
+        """Yield the content list entries while the list downloads.
+
+        Args:
+            cat_id_list: category id list.
+            sortmode: sorting mode.
+            page: which page to display.
+
+        Yields:
+            (id, changed, name, score, downloads) tuples in list order.
+        """
+        uri = self._ListUri(cat_id_list, sortmode, page)
+        lst = self._client.Get(uri, stream='entry', fields=listing.FIELDS)
+        if not lst:
+            return
+        try:
+            for i in lst:
+                if lst.GetStatus() != 'ok':
+                    break
+                yield i
+        except excepts.RequestHandlingError:
+            return
+        finally:
+            lst.close()
+
+    def _ReadListPage(self, cat_id_list, sortmode, page):
+        """Read a whole content list page, telling failures from the end.
+
+        Args:
+            cat_id_list: category id list.
+            sortmode: sorting mode.
+            page: which page to read.
+
+        Returns:
+            A list of (id, changed, name, score, downloads) tuples, empty
+            past the end of the list, or None when the page could not be
+            read in full.
+        """
+        uri = self._ListUri(cat_id_list, sortmode, page)
+        lst = self._client.Get(uri, stream='entry', fields=listing.FIELDS)
+        if not lst:
+            return None
+        entries = []
+        try:
+            for i in lst:
+                entries.append(i)
+        except excepts.RequestHandlingError:
+            return None
+        finally:
+            lst.close()
+        if lst.GetStatus() != 'ok':
+            return None
+        return entries
 
     def GetContent(self, content_id):
         """Retrieve the actual content data by given a content id.
@@ -161,17 +314,21 @@ class Crouke(object):
         # a content contains elements:
         # downloadlink, description, downloadsize, homepage, changelog
         # license, language, preview1, preview2, preview3, smallpreviewpic1
-        content = {}
-        cont = self._client.Get(_METHODS['CONTENT'] % content_id)
-        if cont and cont.status.text == 'ok':
-            content = content.fromkeys(client.GetElementTagFromData(cont.data),
-                                       None)
-            for key in content:
-                if 'text' in getattr(cont.data, key):
-                    content[key] = unicode(
-                        urllib.unquote(getattr(cont.data, key).text), 'utf-8',
-                        'ignore')
-        return content
+        content = self._Stored('content', content_id)
+        if content is not None:
+            return content
+        content = self._client.Get(_METHODS['CONTENT'] % content_id,
+                                   decoder=_CONTENT_DECODER)
+        if content:
+            self._StoreContents([(content_id, content)])
+            return _CopyContent(content)
+        return self._Stored('content', content_id, stale=True) or {}
+
+    def _StoreContents(self, contents):
+        """Store a list of (content id, content) tuples locally."""
+        self._Store('content', [(i, c, store.GetChanged(c.get('changed')))
+                                for i, c in contents],
+                    settings.STORE_CONTENT_TTL)
 
     def Vote(self, content_id, vote):
         """Retrieve vote info for a given content id.
@@ -183,10 +340,13 @@ class Crouke(object):
         Returns:
             the vote status info.
         """
-        vot = self._client.Get(_METHODS['VOTE'] % (content_id, vote))
+        # every vote is sent once, it is neither answered from the tiers,
+        # shared with another vote in flight, retried nor hedged.
+        vot = self._client.Get(_METHODS['VOTE'] % (content_id, vote),
+                               fresh=True, coalesce=False, idempotent=False)
         if vot: return vot.status.text
 
-    def GetAll(self, sortmode=_SORTMODE[0], page=0):
+    def GetAll(self, sortmode=_SORTMODE[0], page=0, callback=None):
         """Retrieve contents from all categories.
         
         The default main page is to point at all category first page
@@ -194,12 +354,364 @@ class Crouke(object):
         Args:
             sortmode: the sorting mode.
             page: the default page.
+            callback: optional callable, called with the index and the
+                      content of every content in listing order as soon
+                      as it and the contents before it are retrieved.
 
         Returns:
             A tuple with a list of category and contents for the given page.
+            A content which could not be retrieved is None in the list.
         """
         cates = self.GetCategory()
         clists = self.GetListId([i[0] for i in cates], sortmode=sortmode,
                                 page=page)
-        contents = [self.GetContent(i) for i in clists]
+        known = {}
+        for index, i in enumerate(clists):
+            content = self._Stored('content', i)
+            if content is not None:
+                known[index] = content
+        contents = self._FanOut([_METHODS['CONTENT'] % i for i in clists],
+                                callback, known=known, convert=_CopyContent,
+                                decoder=_CONTENT_DECODER)
+        self._StoreContents([(clists[index], c)
+                             for index, c in enumerate(contents)
+                             if c and index not in known])
         return ([i[1] for i in cates], contents)
+
+    def Sync(self, cat_id_list=None, max_pages=_SYNC_MAX_PAGES):
+        """Bring the local store up to date with the newest contents.
+
+        A high-water mark of the changed timestamps seen so far is kept per
+        site and category list. The list of the newest contents is read
+        page by page until a page reaches back to the mark, and only the
+        contents whose changed timestamp differs from the stored one are
+        retrieved again; the others are marked fresh. The first sync of a
+        category list reads max_pages pages. The mark only moves on when
+        the pages read reach back to it or to the end of the list, so a
+        page that failed or max_pages being hit leave no gap behind.
+
+        Args:
+            cat_id_list: category id list, None for all categories.
+            max_pages: the maximum list pages read.
+
+        Returns:
+            A list of the ids of the contents retrieved, newest first.
+        """
+        if cat_id_list is None:
+            cat_id_list = [i[0] for i in self.GetCategory()]
+        key = _CATEGORY_SEPARATER.join(sorted(cat_id_list))
+        mark = self._Stored('mark', key)
+        entries = []
+        # whether the pages read reach back to the mark or the list end.
+        reached = mark is None
+        for page in xrange(max_pages):
+            found = self._ReadListPage(cat_id_list, _SORTMODE[0], page)
+            if found is None:
+                reached = False
+                break
+            if not found:
+                reached = True
+                break
+            entries.extend(found)
+            stamps = [store.GetChanged(i[1]) for i in found]
+            stamps = [i for i in stamps if i is not None]
+            # the page doubles as a fresh copy of the list page.
+            self._Store('list', [(self._ListUri(cat_id_list, _SORTMODE[0],
+                                                page),
+                                  found, max(stamps or [None]))],
+                        settings.STORE_LIST_TTL)
+            if mark is not None and stamps and min(stamps) <= mark:
+                reached = True
+                break
+
+        site = self._site or ''
+        moved = []
+        current = []
+        seen = set()
+        for i in entries:
+            changed = store.GetChanged(i[1])
+            if i[0] in seen or (mark is not None and changed is not None and
+                                changed <= mark):
+                continue
+            seen.add(i[0])
+            info = self._store.GetInfo('content', site, i[0])
+            if info and changed is not None and info[0] == changed:
+                current.append(i[0])
+            else:
+                moved.append((i[0], changed))
+        self._store.Touch('content', site, current,
+                          settings.STORE_CONTENT_TTL)
+        # the local tiers of the client may still hold the old contents.
+        found = self._FanOut([_METHODS['CONTENT'] % i for i, c in moved],
+                             fresh=True, decoder=_CONTENT_DECODER)
+        fetched = [(i[0], c) for i, c in zip(moved, found) if c]
+        self._StoreContents(fetched)
+
+        stamps = [store.GetChanged(i[1]) for i in entries]
+        stamps = [i for i in stamps if i is not None]
+        if mark is not None:
+            stamps.append(mark)
+        failed = [i[1] for i, c in zip(moved, found)
+                  if not c and i[1] is not None]
+        if failed:
+            # the contents which failed are retried by the next sync.
+            stamps = [i for i in stamps if i < min(failed)]
+        if not reached:
+            # the entries between the pages read and the mark are unknown,
+            # the next sync has to read back to the mark again.
+            stamps = []
+        if stamps:
+            top = max(stamps)
+            self._Store('mark', [(key, top, top)], -1)
+        return [i for i, c in fetched]
+
+    def GetContents(self, content_ids, workers=_FANOUT_WORKERS):
+        """Retrieve many contents at once.
+
+        Every id is looked up once, however often it is given. The
+        contents found in the local store or the local tiers of the client
+        are served from there, the others are retrieved together by at
+        most workers concurrent batches.
+
+        Args:
+            content_ids: a list of content ids.
+            workers: the maximum batches retrieved at the same time.
+
+        Returns:
+            A dict of content id to (status, content) tuples. The status is
+            'local' for a content served from local state, 'ok' for one
+            retrieved from the site and 'failed' when the content could not
+            be retrieved, in which case the content is an empty dict.
+        """
+        contents = {}
+        missing = []
+        for i in content_ids:
+            if i in contents:
+                continue
+            content = self._Stored('content', i)
+            if content is None:
+                content = self._client.GetLocal(_METHODS['CONTENT'] % i,
+                                                decoder=_CONTENT_DECODER)
+                if content:
+                    content = _CopyContent(content)
+            if content:
+                contents[i] = ('local', content)
+            else:
+                # a placeholder which also marks the id as seen.
+                contents[i] = ('failed', {})
+                missing.append(i)
+        found = self._FanOut([_METHODS['CONTENT'] % i for i in missing],
+                             workers=workers, convert=_CopyContent,
+                             decoder=_CONTENT_DECODER)
+        fetched = [(i, c) for i, c in zip(missing, found) if c]
+        for i, content in fetched:
+            contents[i] = ('ok', content)
+        self._StoreContents(fetched)
+        return contents
+
+    def _FanOut(self, urls, callback=None, workers=_FANOUT_WORKERS,
+                known=None, convert=None, **kws):
+        """Retrieve feeds concurrently, keeping them in the order of urls.
+
+        Up to workers threads take consecutive batches of _FANOUT_BATCH
+        urls and get each batch with one pipelined GetMany, so the first
+        feeds of the list arrive first.
+
+        Args:
+            urls: a list of urls for the feeds.
+            callback: optional callable, called in the calling thread with
+                      the index and the feed of every url in the order of
+                      urls as soon as it and the feeds before it are in.
+            workers: the maximum batches retrieved at the same time.
+            known: optional dict of index to the feeds already at hand,
+                   their urls are not retrieved.
+            convert: optional callable applied to every retrieved feed
+                     before it is reported, e.g. to copy it.
+            kws: extra keyword args passed to the client GetMany.
+
+        Returns:
+            A list of the feeds in the order of urls. A feed which could
+            not be retrieved is None.
+        """
+        results = [None] * len(urls)
+        done = [False] * len(urls)
+        for index, feed in (known or {}).iteritems():
+            results[index] = feed
+            done[index] = True
+        missing = [i for i in xrange(len(urls)) if not done[i]]
+        batches = Queue.Queue()
+        for start in xrange(0, len(missing), _FANOUT_BATCH):
+            batches.put(missing[start:start + _FANOUT_BATCH])
+        count = batches.qsize()
+        finished = Queue.Queue()
+
+        def Work():
+            while True:
+                try:
+                    batch = batches.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    found = self._client.GetMany([urls[i] for i in batch],
+                                                 **kws)
+                except Exception, e:
+                    # a failed batch still counts, its feeds stay None, and
+                    # the worker goes on with the next batch.
+                    print >> sys.stderr, e
+                    found = [None] * len(batch)
+                finished.put((batch, found))
+
+        for i in xrange(min(workers, count)):
+            worker = threading.Thread(target=Work)
+            worker.setDaemon(True)
+            worker.start()
+        emitted = 0
+        # the first round only reports the known feeds at the front.
+        for i in xrange(count + 1):
+            if i:
+                batch, found = finished.get()
+                for index, feed in zip(batch, found):
+                    if feed is not None and convert:
+                        feed = convert(feed)
+                    results[index] = feed
+                    done[index] = True
+            while emitted < len(urls) and done[emitted]:
+                if callback:
+                    callback(emitted, results[emitted])
+                emitted += 1
+        return results
+
+
+class SiteAggregator(object):
+    """Merge the content lists of many sites into one.
+
+    Every site is read by a thread of its own, page by page and at most
+    _AGGREGATE_READ_AHEAD pages ahead of the merge, so all sites are asked
+    at the same time but only as far as the merged list is read.
+    """
+
+    def __init__(self, user=None, password=None, sites=None):
+        """Constructor to init the object.
+
+        Every site is read through a logged in Crouke, so without a user
+        and password the cached login is used.
+
+        Args:
+            user: the login user.
+            password: the login password.
+            sites: a list of the sites to merge, None for settings.SITES.
+
+        Raises:
+            LoadLoginTokenError: when there is neither a user and password
+                                 nor a cached login.
+        """
+        if not (user and password) and LogInToken.HasLoginCache():
+            login = LogInToken()
+            login.Load()
+            user, password = login.GetToken()
+        if not (user and password):
+            raise excepts.LoadLoginTokenError('no login to read the sites with')
+        if sites is None:
+            sites = settings.SITES
+        self._sites = list(sites)
+        self._croukes = dict([(i, Crouke(user, password, i))
+                              for i in self._sites])
+
+    def GetCrouke(self, site):
+        """Return the Crouke object of a site."""
+        return self._croukes[site]
+
+    def IterListEntries(self, cat_ids=None, sortmode=_SORTMODE[0],
+                        max_pages=_AGGREGATE_MAX_PAGES):
+        """Yield the content list entries of all sites in sort order.
+
+        The entries come in the order the sites list them, see
+        listing.Merge, so unlike Crouke.GetListId the 'new' mode gives the
+        newest content first.
+
+        Args:
+            cat_ids: category id list used for all sites, or a dict of site
+                     to category id list; None, or a site missing from the
+                     dict, means all categories of the site.
+            sortmode: sorting mode.
+            max_pages: the maximum list pages read from a site.
+
+        Yields:
+            (site, (id, changed, name, score, downloads)) tuples.
+        """
+        stop = threading.Event()
+        streams = []
+        for site in self._sites:
+            if isinstance(cat_ids, dict):
+                cats = cat_ids.get(site)
+            else:
+                cats = cat_ids
+            pages = Queue.Queue(_AGGREGATE_READ_AHEAD)
+            worker = threading.Thread(target=self._Read,
+                                      args=(self._croukes[site], cats,
+                                            sortmode, max_pages, pages,
+                                            stop))
+            worker.setDaemon(True)
+            worker.start()
+            streams.append(self._Entries(pages))
+        try:
+            for index, entry in listing.Merge(streams, sortmode):
+                yield self._sites[index], entry
+        finally:
+            # lets the readers still waiting to hand over a page go.
+            stop.set()
+
+    def GetPage(self, cat_ids=None, sortmode=_SORTMODE[0], page=0,
+                size=_AGGREGATE_PAGE_SIZE):
+        """Retrieve a page of the list merged from all sites.
+
+        Args:
+            cat_ids: see IterListEntries.
+            sortmode: sorting mode.
+            page: which page to display.
+            size: the number of entries on a page.
+
+        Returns:
+            A list of (site, content id) tuples.
+        """
+        entries = self.IterListEntries(cat_ids, sortmode)
+        try:
+            return [(site, entry[0]) for site, entry in itertools.islice(
+                    entries, page * size, (page + 1) * size)]
+        finally:
+            entries.close()
+
+    def _Read(self, crouke, cats, sortmode, max_pages, pages, stop):
+        """Read the list pages of a site into a queue, None ending them."""
+        try:
+            if cats is None:
+                cats = [i[0] for i in crouke.GetCategory()]
+            for page in xrange(max_pages):
+                if stop.isSet():
+                    return
+                entries = list(crouke.GetListing(cats, sortmode=sortmode,
+                                                 page=page))
+                if not entries:
+                    break
+                while not stop.isSet():
+                    try:
+                        pages.put(entries, True, 1)
+                        break
+                    except Queue.Full:
+                        pass
+        finally:
+            while not stop.isSet():
+                try:
+                    pages.put(None, True, 1)
+                    break
+                except Queue.Full:
+                    pass
+
+    def _Entries(self, pages):
+        """Yield the entries of the pages a reader hands over."""
+        while True:
+            entries = pages.get()
+            if entries is None:
+                return
+            for entry in entries:
+                yield entry
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""Provide a persistent store of the categories, lists and contents of the
+sites, so a session can start from what earlier sessions retrieved.
+"""
+
+import cPickle as pickle
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    kind TEXT NOT NULL,
+    site TEXT NOT NULL,
+    key TEXT NOT NULL,
+    changed INTEGER,
+    fetched REAL NOT NULL,
+    expires REAL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (kind, site, key))
+"""
+
+# path -> ContentStore, see GetStore.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def GetChanged(value):
+    """Return a changed timestamp as a number, or None if it is not one.
+
+    Args:
+        value: a changed text of a feed.
+    """
+    try:
+        return long(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ContentStore(object):
+    """A SQLite store of records keyed by kind, site and key.
+
+    The kinds in use are 'category', 'list', 'content' and 'mark'. Every record
+    carries the changed timestamp of what it holds, when it was fetched and
+    when it expires, so each record has its own time to live.
+
+    Thread-safe.
+    """
+
+    def __init__(self, path):
+        """Constructor to init the object.
+
+        Args:
+            path: the database file.
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        self._path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def Get(self, kind, site, key, stale=False):
+        """Retrieve the value of a record.
+
+        Args:
+            kind: the record kind.
+            site: the site the record comes from.
+            key: the record key.
+            stale: boolean whether an expired record is returned too.
+
+        Returns:
+            The value, or None when there is no such record or it expired.
+        """
+        self._lock.acquire()
+        try:
+            row = self._db.execute(
+                'SELECT expires, value FROM records '
+                'WHERE kind = ? AND site = ? AND key = ?',
+                (kind, site, key)).fetchone()
+        finally:
+            self._lock.release()
+        if row is None:
+            return None
+        expires, value = row
+        if not stale and expires is not None and expires <= time.time():
+            return None
+        return pickle.loads(str(value))
+
+    def GetInfo(self, kind, site, key):
+        """Retrieve when a record changed, was fetched and expires.
+
+        Args:
+            kind: the record kind.
+            site: the site the record comes from.
+            key: the record key.
+
+        Returns:
+            A tuple of (changed, fetched, expires), or None when there is
+            no such record. expires is None for a record that never
+            expires.
+        """
+        self._lock.acquire()
+        try:
+            return self._db.execute(
+                'SELECT changed, fetched, expires FROM records '
+                'WHERE kind = ? AND site = ? AND key = ?',
+                (kind, site, key)).fetchone()
+        finally:
+            self._lock.release()
+
+    def Put(self, kind, site, key, value, ttl, changed=None):
+        """Store a record, replacing the one with the same key.
+
+        See PutMany.
+        """
+        self.PutMany(kind, site, [(key, value, changed)], ttl)
+
+    def PutMany(self, kind, site, records, ttl):
+        """Store many records in one transaction.
+
+        Args:
+            kind: the record kind.
+            site: the site the records come from.
+            records: a list of (key, value, changed) tuples. changed is the
+                     changed timestamp of the value, or None.
+            ttl: seconds the records are fresh for. A negative ttl keeps
+                 them fresh for ever, and 0 stores nothing.
+        """
+        if not ttl or not records:
+            return
+        now = time.time()
+        expires = None
+        if ttl > 0:
+            expires = now + ttl
+        rows = [(kind, site, key, changed, now, expires,
+                 sqlite3.Binary(pickle.dumps(value, 2)))
+                for key, value, changed in records]
+        self._lock.acquire()
+        try:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO records '
+                '(kind, site, key, changed, fetched, expires, value) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def Touch(self, kind, site, keys, ttl):
+        """Mark records as fetched just now, e.g. when they are known to
+        be current, so they are fresh for another ttl seconds.
+
+        Args:
+            kind: the record kind.
+            site: the site the records come from.
+            keys: a list of record keys. Keys without a record are ignored.
+            ttl: seconds the records are fresh for. A negative ttl keeps
+                 them fresh for ever, and 0 does nothing.
+        """
+        if not ttl or not keys:
+            return
+        now = time.time()
+        expires = None
+        if ttl > 0:
+            expires = now + ttl
+        self._lock.acquire()
+        try:
+            self._db.executemany(
+                'UPDATE records SET fetched = ?, expires = ? '
+                'WHERE kind = ? AND site = ? AND key = ?',
+                [(now, expires, kind, site, key) for key in keys])
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def Purge(self, before=None):
+        """Delete the records which expired.
+
+        Args:
+            before: delete the records expired before this time, None for
+                    now.
+
+        Returns:
+            The number of records deleted.
+        """
+        if before is None:
+            before = time.time()
+        self._lock.acquire()
+        try:
+            count = self._db.execute(
+                'DELETE FROM records WHERE expires <= ?', (before,)).rowcount
+            self._db.commit()
+            return count
+        finally:
+            self._lock.release()
+
+    def Close(self):
+        """Close the database."""
+        self._lock.acquire()
+        try:
+            self._db.close()
+        finally:
+            self._lock.release()
+
+
+def GetStore(path):
+    """Return the store of a database file, opening it on first use.
+
+    Args:
+        path: the database file.
+
+    Returns:
+        A ContentStore object shared by all callers of the same path.
+    """
+    _stores_lock.acquire()
+    try:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ContentStore(path)
+        return store
+    finally:
+        _stores_lock.release()
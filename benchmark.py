@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""Benchmark the feed parsing hot path on synthetic OCS feeds.
+
+Usage: python benchmark.py [-o results.json] [-s 10,100,1000] [-r 3]
+
+CATEGORIES, LIST and GET feeds are generated at each size, and every
+benchmark reports its best time, the throughput and the memory it took.
+The memory of each benchmark is measured in a process of its own. With
+tracemalloc it is the peak of the traced memory and the blocks the result
+keeps alive. Without it, it is how far the resident set size grew past
+what the process started with, and the gc tracked objects the result
+keeps alive, counted with the collector off. The keys of the measure that
+was not taken are null. Every benchmark returns what a caller would hold
+on to, e.g. the parsed feed along with the fields read from it.
+
+Only the parsing modules are imported, so no installed ~/.crouke is
+needed.
+"""
+
+# System library
+import gc
+import json
+import multiprocessing
+from optparse import OptionParser
+import platform
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Crouke library
+from backend import client
+from backend import listing
+from backend import objectifyxml
+
+_SIZES = (10, 100, 1000, 10000, 100000)
+_REPEAT = 3
+
+_LICENSES = ('GPL', 'LGPL', 'BSD', 'Artistic', 'Creative Commons')
+_LANGUAGES = ('en', 'de', 'fr', 'es', 'it')
+
+
+def CategoriesFeed(size):
+    """Return a /V1/CATEGORIES feed with size categories."""
+    entries = ['<category><id>%d</id><name>Category%%20%d</name></category>'
+               % (i, i) for i in xrange(size)]
+    return ('<?xml version="1.0"?><ocs><meta><status>ok</status>'
+            '<statuscode>100</statuscode><totalitems>%d</totalitems></meta>'
+            '<data>%s</data></ocs>' % (size, ''.join(entries)))
+
+
+def ListFeed(size):
+    """Return a /V1/LIST feed with size entries."""
+    entries = ['<entry details="summary"><id>%d</id><name>Theme%%20%d'
+               '</name><version>1.%d</version><changed>%d</changed>'
+               '<created>%d</created><typeid>%d</typeid><typename>KDE'
+               '</typename><language>%s</language><personid>user%d'
+               '</personid><downloads>%d</downloads><score>%d</score>'
+               '<comments>%d</comments><smallpreviewpic1>http://example.com/'
+               'p/%d.png</smallpreviewpic1></entry>'
+               % (i, i, i % 10, 1200000000 + i * 7919 % 100003,
+                  1100000000 + i, i % 40, _LANGUAGES[i % 5], i % 97,
+                  i * 31 % 10007, i * 17 % 101, i % 13, i)
+               for i in xrange(size)]
+    return ('<?xml version="1.0"?><ocs><status>ok</status>'
+            '<message></message><data>%s</data></ocs>' % ''.join(entries))
+
+
+def ContentFeeds(size):
+    """Return a list of size /V1/GET feeds."""
+    return ['<?xml version="1.0"?><ocs><status>ok</status><message></message>'
+            '<data><id>%d</id><name>Theme%%20%d</name><version>1.%d'
+            '</version><changed>%d</changed><typeid>%d</typeid><typename>KDE'
+            '</typename><language>%s</language><personid>user%d</personid>'
+            '<downloads>%d</downloads><score>%d</score><license>%s</license>'
+            '<homepage>http://example.com/%d</homepage><description>%s'
+            '</description><changelog>%s</changelog><preview1>http://'
+            'example.com/p/%d.png</preview1><preview2></preview2>'
+            '<downloadlink1>http://example.com/d/%d.tar.gz</downloadlink1>'
+            '</data></ocs>'
+            % (i, i, i % 10, 1200000000 + i, i % 40, _LANGUAGES[i % 5],
+               i % 97, i * 31 % 10007, i * 17 % 101, _LICENSES[i % 5], i,
+               'A%20theme%20for%20KDE. ' * 8, 'Fixed things. ' * 4, i, i)
+            for i in xrange(size)]
+
+
+def _Objectify(category, bodies, lazy):
+    return [objectifyxml.ContentParser(b, category, lazy=lazy).objectify()
+            for b in bodies]
+
+
+def _ListFields(body, lazy):
+    # the fields GetListId reads, so lazy objectify builds what it needs.
+    feed = objectifyxml.ContentParser(body, 'LIST', lazy=lazy).objectify()
+    return feed, [tuple([getattr(e, f).text for f in listing.FIELDS])
+                  for e in feed.data.entry]
+
+
+def _ElementTags(feeds):
+    return [client.GetElementTagFromData(f.data) for f in feeds]
+
+
+def _ListIds(body):
+    # what Crouke.GetListId does with a downloaded list.
+    stream = objectifyxml.EntryStream(body, fields=listing.FIELDS)
+    lst = listing.Listing(stream)
+    return lst, lst.GetIds(lst.Order('new'))
+
+
+def _Contents(bodies):
+    # what Crouke.GetContent does with each downloaded content.
+    decoder = objectifyxml.ContentDecoder()
+    return [objectifyxml.ContentParser(b, 'CONTENT').project(decoder)
+            for b in bodies]
+
+
+def _Rss():
+    """Return the resident set size of the process in bytes, or None."""
+    try:
+        f = open('/proc/self/statm')
+        try:
+            return int(f.read().split()[1]) * resource.getpagesize()
+        finally:
+            f.close()
+    except (IOError, OSError, AttributeError):
+        return None
+
+
+def _MeasureMemory(func):
+    """Measure the memory a call takes, in the calling process.
+
+    Returns:
+        A dict with the peak_traced_bytes, retained_blocks,
+        peak_rss_delta_bytes and retained_objects keys.
+    """
+    memory = dict.fromkeys(['peak_traced_bytes', 'retained_blocks',
+                            'peak_rss_delta_bytes', 'retained_objects'])
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        try:
+            result = func()
+            memory['retained_blocks'] = sum(
+                s.count for s in
+                tracemalloc.take_snapshot().statistics('lineno'))
+            memory['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    else:
+        start = _Rss()
+        # a collection half way would take the garbage made before func
+        # off the count.
+        gc.disable()
+        try:
+            before = len(gc.get_objects())
+            result = func()
+            memory['retained_objects'] = len(gc.get_objects()) - before
+        finally:
+            gc.enable()
+        if resource and start is not None:
+            # ru_maxrss is the high-water mark of this process, in
+            # kilobytes on linux, and it never goes down. The process is
+            # new, so what it adds to the start is what func took.
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            memory['peak_rss_delta_bytes'] = max(0, peak - start)
+    del result
+    return memory
+
+
+def _Memory(func):
+    """Measure the memory a call takes, in a forked process of its own.
+
+    The memory the earlier benchmarks took is then not counted again.
+
+    Returns:
+        A dict with the peak_traced_bytes, retained_blocks,
+        peak_rss_delta_bytes and retained_objects keys; the keys of the
+        measure that was not taken are None.
+    """
+    receiver, sender = multiprocessing.Pipe(False)
+
+    def Measure():
+        sender.send(_MeasureMemory(func))
+        sender.close()
+
+    worker = multiprocessing.Process(target=Measure)
+    worker.start()
+    try:
+        return receiver.recv()
+    finally:
+        worker.join()
+
+
+def _Run(name, size, payload, func, repeat):
+    """Run one benchmark.
+
+    Args:
+        name: the benchmark name.
+        size: the number of entries in the payload.
+        payload: the number of xml bytes func works on.
+        func: the callable to measure.
+        repeat: how many times func is timed.
+
+    Returns:
+        A dict of the benchmark results.
+    """
+    best = None
+    for i in xrange(repeat):
+        gc.collect()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    result = _Memory(func)
+    best = max(best, 1e-9)
+    result.update({'benchmark': name, 'size': size, 'bytes': payload,
+                   'seconds': best, 'entries_per_second': size / best,
+                   'bytes_per_second': payload / best})
+    return result
+
+
+def RunBenchmarks(sizes=_SIZES, repeat=_REPEAT, log=None):
+    """Run all benchmarks at the given sizes.
+
+    Args:
+        sizes: the numbers of entries of the generated feeds.
+        repeat: how many times each benchmark is timed.
+        log: optional file the results are reported to as they come.
+
+    Returns:
+        A list of dicts of the benchmark results.
+    """
+    results = []
+
+    def Run(name, size, payload, func):
+        result = _Run(name, size, payload, func, repeat)
+        results.append(result)
+        if log:
+            log.write('%-22s %7d %10.4fs %12.0f entries/s\n' % (
+                      name, size, result['seconds'],
+                      result['entries_per_second']))
+
+    for size in sizes:
+        body = CategoriesFeed(size)
+        Run('objectify.categories', size, len(body),
+            lambda: _Objectify('CATEGORIES', [body], False))
+        body = ListFeed(size)
+        Run('objectify.list', size, len(body),
+            lambda: _ListFields(body, False))
+        Run('objectify.list.lazy', size, len(body),
+            lambda: _ListFields(body, True))
+        Run('decode.list_ids', size, len(body), lambda: _ListIds(body))
+        bodies = ContentFeeds(size)
+        payload = sum([len(b) for b in bodies])
+        Run('objectify.content', size, payload,
+            lambda: _Objectify('CONTENT', bodies, False))
+        feeds = _Objectify('CONTENT', bodies, False)
+        Run('element_tags', size, payload, lambda: _ElementTags(feeds))
+        feeds = None
+        Run('decode.content', size, payload, lambda: _Contents(bodies))
+    return results
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', dest='output', default='-',
+                      help='file the JSON results are written to, '
+                           '- for stdout')
+    parser.add_option('-s', '--sizes', dest='sizes',
+                      default=','.join([str(i) for i in _SIZES]),
+                      help='comma separated feed sizes in entries')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int',
+                      default=_REPEAT, help='timed runs per benchmark')
+    options, args = parser.parse_args()
+    sizes = [int(i) for i in options.sizes.split(',') if i]
+    results = RunBenchmarks(sizes, options.repeat, sys.stderr)
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'tracemalloc': bool(tracemalloc),
+              'time': time.time(),
+              'results': results}
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        out = open(options.output, 'w')
+        try:
+            json.dump(report, out, indent=2, sort_keys=True)
+        finally:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
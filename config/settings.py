@@ -27,6 +27,11 @@ FEED_UPDATE = None
 NOTIFY = None
 SITES = None
 TEMP_DIR = None
+# Seconds the local store serves categories, lists and contents without
+# asking the site. 0 does not store them, a negative value never expires.
+STORE_CATEGORY_TTL = 86400
+STORE_LIST_TTL = 600
+STORE_CONTENT_TTL = 86400
 
 
 def _CopyDefault():
@@ -67,3 +72,12 @@ def ParseRC(conf_file):
     if 'TEMP_DIR' in _d:
         global TEMP_DIR
         TEMP_DIR = _d.get('TEMP_DIR')
+    if 'STORE_CATEGORY_TTL' in _d:
+        global STORE_CATEGORY_TTL
+        STORE_CATEGORY_TTL = int(_d.get('STORE_CATEGORY_TTL'))
+    if 'STORE_LIST_TTL' in _d:
+        global STORE_LIST_TTL
+        STORE_LIST_TTL = int(_d.get('STORE_LIST_TTL'))
+    if 'STORE_CONTENT_TTL' in _d:
+        global STORE_CONTENT_TTL
+        STORE_CONTENT_TTL = int(_d.get('STORE_CONTENT_TTL'))
@@ -1,3 +1,4 @@
+import os
 import locale
 import gettext
 import settings
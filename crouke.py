@@ -13,6 +13,7 @@ import time
 # Crouke UI module
 import croukeui
 import utils
+from backend import client
 from config import settings
 from config import texts as _
 
@@ -206,6 +207,9 @@ def main(argv):
     options, args = utils.ParseOptions(argv)
     if not options.enable_tray: runself = True
     if not options.conf_file: conf_file = settings.RC
+    # Pay DNS lookups and TCP handshakes before the user clicks a site.
+    if not settings.SITES: settings.ParseRC(options.conf_file)
+    client.WarmUp(settings.SITES)
     CroukeIcon(enable_tray=options.enable_tray, animate=options.animate,
         icon_file=icon_file, tips=_.tips, conf_file=conf_file,
         runself=runself).main()
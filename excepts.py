@@ -17,3 +17,8 @@ class SaveLoginTokenError(Error):
 # Exception raised when Request/Response handling error.
 class RequestHandlingError(Error):
     pass
+
+# Exception raised when a request failed in a way trying again may fix, e.g.
+# a transport error, a timeout or a 5xx response.
+class TransientRequestError(RequestHandlingError):
+    pass
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""Provide a local OCS server the tests send their requests to.
+"""
+
+# System library
+import BaseHTTPServer
+import hashlib
+import os
+import re
+import SocketServer
+import sys
+import threading
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [_ROOT, os.path.join(_ROOT, 'backend')]
+
+_FEED = ('<?xml version="1.0"?><ocs><status>ok</status><message></message>'
+         '<data>%s</data></ocs>')
+
+
+def ContentFeed(content_id):
+    """Return the /V1/GET feed of a content id."""
+    return _FEED % ('<id>%s</id><name>Theme%%20%s</name><changed>%s'
+                    '</changed><score>50</score><downloads>7</downloads>'
+                    % (content_id, content_id, content_id))
+
+
+def ListFeed(page, size=20, newest=None):
+    """Return a page of a /V1/LIST feed.
+
+    Without newest the list never ends. With it, the list holds the contents
+    newest down to 0, newest first, each changed at its id.
+    """
+    if newest is None:
+        ids = xrange(page * size, page * size + size)
+        return _FEED % ''.join([
+            '<entry><id>%d</id><changed>%d</changed><name>Theme%%20%d</name>'
+            '<score>%d</score><downloads>%d</downloads></entry>'
+            % (i, 1000000 - i, i, i % 100, i * 3) for i in ids])
+    ids = xrange(newest - page * size, max(newest - page * size - size, -1),
+                 -1)
+    return _FEED % ''.join([
+        '<entry><id>%d</id><changed>%d</changed><name>Theme%%20%d</name>'
+        '<score>%d</score><downloads>%d</downloads></entry>'
+        % (i, i, i, i % 100, i * 3) for i in ids])
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.server.Count('connections')
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.Count('requests')
+        self.server.paths.append(self.path)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        match = re.match(r'/V1/(\w+)/(\w*)/?(\w*)/?(\w*)', self.path)
+        category, arg = match.group(1), match.group(2)
+        if arg in self.server.fail or self.path in self.server.fail:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if category == 'LIST':
+            body = ListFeed(int(match.group(4) or 0),
+                            newest=self.server.newest)
+        else:
+            body = ContentFeed(arg)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.server.etags and self.headers.get('if-none-match') == etag:
+            self.server.Count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.etags:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A threaded OCS server on a free local port.
+
+    Counts the connections and requests it gets. The contents whose ids or
+    the paths in fail are answered with a 503, and every answer waits delay
+    seconds. newest is the newest content id of a list which ends, None for
+    a list which never does. With etags the answers carry an ETag, and a
+    request sending it back is answered with a 304.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.address = '127.0.0.1:%d' % self.server_address[1]
+        self.counts = {'connections': 0, 'requests': 0, 'not_modified': 0}
+        self.paths = []
+        self.fail = set()
+        self.delay = 0
+        self.newest = None
+        self.etags = False
+        self._lock = threading.Lock()
+
+    def Count(self, name):
+        self._lock.acquire()
+        try:
+            self.counts[name] += 1
+        finally:
+            self._lock.release()
+
+    def Start(self):
+        """Serve on a background thread."""
+        worker = threading.Thread(target=self.serve_forever)
+        worker.setDaemon(True)
+        worker.start()
+
+    def Stop(self):
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
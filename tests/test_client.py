@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+
+"""Test the request path of the client against a local server.
+"""
+
+# System library
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+# Crouke library
+import localserver
+from backend import client
+
+
+class _ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = localserver.LocalServer()
+        self.server.Start()
+        self.handler = client.DefaultCRUDHandler(server=self.server.address)
+
+    def tearDown(self):
+        client.GetConnectionPool(self.server.address).Close()
+        self.server.Stop()
+
+
+class ConnectionPoolTest(_ServerTest):
+
+    def testReusesConnection(self):
+        for i in range(3):
+            feed = self.handler.Get('/V1/GET/%d/' % i)
+            self.assertEqual(str(i), feed.data.id.text)
+        self.assertEqual(3, self.server.counts['requests'])
+        self.assertEqual(1, self.server.counts['connections'])
+
+    def testAcquireBlocksWhenExhausted(self):
+        pool = client.ConnectionPool(self.server.address, size=1)
+        conn, reused = pool.Acquire()
+        acquired = threading.Event()
+
+        def Acquire():
+            pool.Acquire()
+            acquired.set()
+
+        worker = threading.Thread(target=Acquire)
+        worker.setDaemon(True)
+        worker.start()
+        self.assertFalse(acquired.wait(0.2))
+        pool.Release(conn)
+        self.assertTrue(acquired.wait(5))
+
+
+class TimeoutTest(_ServerTest):
+
+    def setUp(self):
+        _ServerTest.setUp(self)
+        client._pools[self.server.address] = client.ConnectionPool(
+            self.server.address, timeout=0.2)
+
+    def testTimeoutIsNotResent(self):
+        self.handler.Get('/V1/GET/1/')
+        self.server.delay = 0.5
+        self.assertRaises(client.excepts.TransientRequestError,
+                          self.handler.Get, '/V1/GET/2/')
+        self.assertEqual(2, self.server.counts['requests'])
+
+    def testPipelinedTimeoutIsNotResent(self):
+        self.handler.Get('/V1/GET/1/')
+        self.server.delay = 0.5
+        self.assertEqual([None], self.handler.GetMany(['/V1/GET/2/']))
+        self.assertEqual(2, self.server.counts['requests'])
+
+
+class StaleConnectionTest(_ServerTest):
+
+    def _BreakPooledConnection(self):
+        self.handler.Get('/V1/GET/1/')
+        pool = client.GetConnectionPool(self.server.address)
+        conn, reused = pool.Acquire()
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        pool.Release(conn)
+
+    def testIdempotentIsResent(self):
+        self._BreakPooledConnection()
+        feed = self.handler.Get('/V1/GET/2/')
+        self.assertEqual('2', feed.data.id.text)
+
+    def testNonIdempotentIsNotResent(self):
+        self._BreakPooledConnection()
+        self.assertRaises(client.excepts.TransientRequestError,
+                          self.handler.Get, '/V1/GET/2/', idempotent=False)
+        self.assertEqual(1, self.server.counts['requests'])
+
+
+class RequestPolicyTest(unittest.TestCase):
+
+    def _Failing(self, errors):
+        """Return a func raising the given errors before it returns 'ok'."""
+        calls = []
+
+        def Func(*args, **kws):
+            calls.append(kws)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return 'ok'
+
+        return Func, calls
+
+    def testRetriesTransientErrors(self):
+        policy = client.RequestPolicy(retries=2, backoff=0)
+        func, calls = self._Failing([client.excepts.TransientRequestError(),
+                                     client.excepts.TransientRequestError()])
+        self.assertEqual('ok', policy.Call(func, idempotent=True))
+        self.assertEqual(3, len(calls))
+
+    def testOtherErrorsAreNotRetried(self):
+        policy = client.RequestPolicy(retries=2, backoff=0)
+        func, calls = self._Failing([client.excepts.RequestHandlingError()])
+        self.assertRaises(client.excepts.RequestHandlingError, policy.Call,
+                          func, idempotent=True)
+        self.assertEqual(1, len(calls))
+
+    def testNonIdempotentIsNotRetried(self):
+        policy = client.RequestPolicy(retries=2, backoff=0)
+        func, calls = self._Failing([client.excepts.TransientRequestError()])
+        self.assertRaises(client.excepts.TransientRequestError, policy.Call,
+                          func, idempotent=False)
+        self.assertEqual(1, len(calls))
+
+    def testDeadline(self):
+        policy = client.RequestPolicy(deadline=0.1)
+        start = time.time()
+        self.assertRaises(client.excepts.RequestHandlingError, policy.Call,
+                          time.sleep, (1,), idempotent=True)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def testSlowCallIsHedged(self):
+        policy = client.RequestPolicy(hedge_percentile=50)
+        for i in range(client._HEDGE_MIN_SAMPLES):
+            policy._Record(0.01)
+        calls = []
+
+        def Func(**kws):
+            calls.append(kws)
+            if len(calls) == 1:
+                time.sleep(1)
+                return 'slow'
+            return 'fast'
+
+        self.assertEqual('fast', policy.Call(Func, idempotent=True))
+        self.assertEqual(False, calls[1]['coalesce'])
+
+
+class WarmUpTest(_ServerTest):
+
+    def testPrimedConnectionIsReused(self):
+        client.WarmUp([self.server.address, 'nonexistent.invalid'],
+                      background=False)
+        self.handler.Get('/V1/GET/1/')
+        self.assertEqual(1, self.server.counts['connections'])
+
+
+class PipelineTest(_ServerTest):
+
+    def testGetManyKeepsOrder(self):
+        urls = ['/V1/GET/%d/' % i for i in range(10)]
+        feeds = self.handler.GetMany(urls)
+        self.assertEqual([str(i) for i in range(10)],
+                         [f.data.id.text for f in feeds])
+        self.assertEqual(10, self.server.counts['requests'])
+        self.assertTrue(self.server.counts['connections'] <=
+                        client._PIPELINE_CONNECTIONS)
+
+    def testFailedFeedIsNone(self):
+        self.server.fail.add('3')
+        feeds = self.handler.GetMany(['/V1/GET/%d/' % i for i in range(5)])
+        self.assertEqual(None, feeds[3])
+        self.assertEqual(['0', '1', '2', '4'],
+                         [f.data.id.text for f in feeds if f is not None])
+
+
+class SingleFlightTest(_ServerTest):
+
+    def testConcurrentGetsShareOneRequest(self):
+        self.server.delay = 0.3
+        feeds = []
+
+        def Get():
+            feeds.append(self.handler.Get('/V1/GET/1/'))
+
+        workers = [threading.Thread(target=Get) for i in range(5)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(1, self.server.counts['requests'])
+        self.assertEqual(5, len(feeds))
+        for feed in feeds:
+            self.assertTrue(feed is feeds[0])
+
+    def testNoCoalesce(self):
+        self.handler.Get('/V1/GET/1/', coalesce=False)
+        self.handler.Get('/V1/GET/1/', coalesce=False)
+        self.assertEqual(2, self.server.counts['requests'])
+
+
+class HTTPCacheTest(_ServerTest):
+
+    def setUp(self):
+        _ServerTest.setUp(self)
+        self.server.etags = True
+        self.tmp = tempfile.mkdtemp()
+        self.cache = client.HTTPCache(self.tmp)
+        self.handler = client.DefaultCRUDHandler(server=self.server.address,
+                                                 cache=self.cache)
+
+    def tearDown(self):
+        _ServerTest.tearDown(self)
+        shutil.rmtree(self.tmp)
+
+    def testNotModifiedIsServedFromCache(self):
+        first = self.handler.Get('/V1/GET/1/')
+        feed = self.handler.Get('/V1/GET/1/', coalesce=False)
+        self.assertEqual(1, self.server.counts['not_modified'])
+        self.assertTrue(feed is first)
+
+    def testNotModifiedIsParsedFromCachedBody(self):
+        self.handler.Get('/V1/GET/1/')
+        # as after a restart, only the body on disk is left.
+        self.handler = client.DefaultCRUDHandler(
+            server=self.server.address, cache=client.HTTPCache(self.tmp))
+        feed = self.handler.Get('/V1/GET/1/')
+        self.assertEqual(1, self.server.counts['not_modified'])
+        self.assertEqual('1', feed.data.id.text)
+
+    def testNotModifiedStream(self):
+        url = '/V1/LIST/1/new/0'
+        ids = [e.id.text for e in self.handler.Get(url, stream='entry')]
+        stream = self.handler.Get(url, stream='entry')
+        self.assertEqual(ids, [e.id.text for e in stream])
+        self.assertEqual(1, self.server.counts['not_modified'])
+
+
+class TiersTest(_ServerTest):
+
+    def setUp(self):
+        _ServerTest.setUp(self)
+        self.tmp = tempfile.mkdtemp()
+        self.client = self._Client()
+
+    def tearDown(self):
+        _ServerTest.tearDown(self)
+        shutil.rmtree(self.tmp)
+
+    def _Client(self):
+        crouke_client = client.CroukeClient()
+        crouke_client.RegisterTiers(self.handler, directory=self.tmp)
+        return crouke_client
+
+    def testMemoryTierAnswersAgain(self):
+        feed = self.client.Get('/V1/GET/1/')
+        self.assertTrue(feed is self.client.Get('/V1/GET/1/'))
+        self.assertEqual(1, self.server.counts['requests'])
+
+    def testDiskTierIsPromotedToMemory(self):
+        self.client.Get('/V1/GET/1/')
+        # as after a restart, only the disk tier is left.
+        self.client = self._Client()
+        self.assertEqual('1', self.client.Get('/V1/GET/1/').data.id.text)
+        self.client.Get('/V1/GET/1/')
+        self.assertEqual(1, self.server.counts['requests'])
+        memory, disk, network = [stats for handler, stats in
+                                 self.client.GetHandlerStats()]
+        self.assertEqual((1, 1), (memory['hits'], disk['hits']))
+
+    def testFreshSkipsLocalTiers(self):
+        self.client.Get('/V1/GET/1/')
+        self.client.Get('/V1/GET/1/', fresh=True)
+        self.assertEqual(2, self.server.counts['requests'])
+
+    def testVoteIsNotKept(self):
+        self.client.Get('/V1/VOTE/1/good', coalesce=False, idempotent=False)
+        self.client.Get('/V1/VOTE/1/good', coalesce=False, idempotent=False)
+        self.assertEqual(2, self.server.counts['requests'])
+
+    def testAuthorizationIsPartOfKey(self):
+        tier = client.MemoryTier(self.server.address)
+        tier.Store('/V1/GET/1/', 'feed', headers={'Authorization': 'a'})
+        self.assertEqual(None, tier.Get('/V1/GET/1/',
+                                        headers={'Authorization': 'b'}))
+        self.assertEqual(None, tier.Get('/V1/GET/1/'))
+        self.assertEqual('feed', tier.Get('/V1/GET/1/',
+                                          headers={'authorization': 'a'}))
+
+
+class ParseMemoTest(unittest.TestCase):
+
+    def testHitIsNotParsed(self):
+        body = localserver.ListFeed(0)
+        memo = client.ParseMemo()
+        digest = client.DigestChunks([body])
+        feed = client.ContentParser([body], 'LIST', memo=memo,
+                                    digest=digest).objectify()
+
+        def Chunks():
+            raise AssertionError('parsed again')
+            yield body
+
+        self.assertTrue(feed is client.ContentParser(
+            Chunks(), 'LIST', memo=memo, digest=digest).objectify())
+
+
+class HostSchedulerTest(unittest.TestCase):
+
+    def testBatchTakesATokenPerRequest(self):
+        scheduler = client.HostScheduler(rate=100, max_rate=100)
+        start = time.time()
+        scheduler.Acquire(20)
+        scheduler.Release(0, 'error')
+        scheduler.Acquire(20)
+        scheduler.Release(0, 'error')
+        # 1 token to start with, 39 more at 100 per second.
+        self.assertTrue(time.time() - start >= 0.35)
+
+    def testWindowLimitsInFlight(self):
+        scheduler = client.HostScheduler()
+        scheduler.Acquire()
+        acquired = threading.Event()
+
+        def Acquire():
+            scheduler.Acquire()
+            acquired.set()
+
+        worker = threading.Thread(target=Acquire)
+        worker.setDaemon(True)
+        worker.start()
+        self.assertFalse(acquired.wait(0.2))
+        scheduler.Release(0.01, 'ok')
+        self.assertTrue(acquired.wait(5))
+
+    def testOverloadHalvesRate(self):
+        scheduler = client.HostScheduler(rate=8)
+        scheduler.Acquire()
+        scheduler.Release(0.01, 'overload')
+        self.assertEqual(4.0, scheduler.GetStats()['rate'])
+
+    def testAcquireTimesOut(self):
+        scheduler = client.HostScheduler()
+        self.assertTrue(scheduler.Acquire())
+        self.assertFalse(scheduler.Acquire(timeout=0.1))
+
+    def testRetryAfterIsCapped(self):
+        scheduler = client.HostScheduler()
+        scheduler.Acquire()
+        scheduler.Release(0.01, 'overload', '86400')
+        self.assertTrue(scheduler._paused_until - time.time() <=
+                        client._MAX_RETRY_AFTER)
+
+
+class StreamTest(_ServerTest):
+
+    def testOpenStreamDoesNotHoldTheHost(self):
+        stream = self.handler.Get('/V1/LIST/1/new/0', stream='entry')
+        iter(stream).next()
+        feed = self.handler.Get('/V1/GET/1/')
+        self.assertEqual('1', feed.data.id.text)
+        stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Test the columnar listing of LIST entries.
+"""
+
+# System library
+import unittest
+
+# Crouke library
+# localserver puts the repo root on sys.path.
+import localserver
+from backend import listing
+
+
+def _Entry(content_id, changed, name='', score=0, downloads=0):
+    """Return a list entry tuple as Crouke.IterListEntries yields it."""
+    return (str(content_id), str(changed), name, str(score), str(downloads))
+
+
+class ListingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lst = listing.Listing([_Entry(1, 30, 'b', 5, 7),
+                                    _Entry(2, 10, 'c', 9, 1),
+                                    _Entry(3, 20, 'a', 5, 3)])
+
+    def testOrderNewIsOldestFirst(self):
+        self.assertEqual(['2', '3', '1'],
+                         self.lst.GetIds(self.lst.Order('new')))
+
+    def testOrderAlpha(self):
+        self.assertEqual(['3', '1', '2'],
+                         self.lst.GetIds(self.lst.Order('alpha')))
+
+    def testOrderHighIsStable(self):
+        self.assertEqual(['2', '1', '3'],
+                         self.lst.GetIds(self.lst.Order('high')))
+
+    def testOrderDown(self):
+        self.assertEqual(['1', '3', '2'],
+                         self.lst.GetIds(self.lst.Order('down')))
+
+    def testUnknownSortModeKeepsListOrder(self):
+        self.assertEqual(['1', '2', '3'],
+                         self.lst.GetIds(self.lst.Order('nonexistent')))
+
+    def testFilter(self):
+        self.assertEqual(['1', '3'],
+                         self.lst.Filter('changed', low=20).GetIds())
+
+    def testMalformedFieldsCountAsZero(self):
+        lst = listing.Listing([('4', 'soon', 'd', None, '1e3'),
+                               ('5', str(10 ** 30), 'e', '', '2')])
+        self.assertEqual([('4', '0', 'd', '0', '0'),
+                          ('5', '0', 'e', '0', '2')], list(lst))
+
+
+class MergeTest(unittest.TestCase):
+
+    def testNewestFirst(self):
+        streams = [[_Entry(1, 30), _Entry(2, 10)],
+                   [_Entry(3, 40), _Entry(4, 20), _Entry(5, 5)]]
+        merged = list(listing.Merge(streams, 'new'))
+        self.assertEqual(['3', '1', '4', '2', '5'],
+                         [entry[0] for index, entry in merged])
+        self.assertEqual([1, 0, 1, 0, 1], [index for index, entry in merged])
+
+    def testEqualKeysKeepStreamOrder(self):
+        streams = [[_Entry(1, 0, score=5)], [_Entry(2, 0, score=5)]]
+        self.assertEqual(['1', '2'], [entry[0] for index, entry in
+                                      listing.Merge(streams, 'high')])
+
+    def testUnknownSortModeChainsStreams(self):
+        streams = [[_Entry(1, 10)], [_Entry(2, 30)]]
+        self.assertEqual(['1', '2'], [entry[0] for index, entry in
+                                      listing.Merge(streams, 'nonexistent')])
+
+    def testStreamsAreReadLazily(self):
+        read = []
+
+        def Stream(ids):
+            for i in ids:
+                read.append(i)
+                yield _Entry(i, 100 - i)
+
+        merged = listing.Merge([Stream([1, 2, 3]), Stream([4, 5, 6])], 'new')
+        merged.next()
+        self.assertEqual([1, 4], read)
+
+    def testMergeIsReverseOfOrderForNew(self):
+        entries = [_Entry(1, 30), _Entry(2, 10), _Entry(3, 20)]
+        lst = listing.Listing(entries)
+        merged = [entry[0] for index, entry in
+                  listing.Merge([[entries[0], entries[2], entries[1]]],
+                                'new')]
+        self.assertEqual(merged[::-1], lst.GetIds(lst.Order('new')))
+
+
+if __name__ == '__main__':
+    unittest.main()
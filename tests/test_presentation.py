@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""Test the fan-out and the sync of Crouke against a local server.
+
+The presentation module reads the installed category mappings, so these
+tests need an installed ~/.crouke.
+"""
+
+# System library
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Crouke library
+import localserver
+from backend import client
+from backend import presentation
+
+
+class _FailingClient(object):
+    """A client whose GetMany fails for the batches holding a url."""
+
+    def __init__(self, url):
+        self._url = url
+
+    def GetMany(self, urls, **kws):
+        if self._url in urls:
+            raise ValueError(self._url)
+        return list(urls)
+
+
+class FanOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = localserver.LocalServer()
+        self.server.Start()
+        self.crouke = presentation.Crouke()
+        self.crouke._client = client.CroukeClient()
+        self.crouke._client.RegisterHandlers('Get', client.DefaultCRUDHandler(
+                                             server=self.server.address))
+
+    def tearDown(self):
+        client.GetConnectionPool(self.server.address).Close()
+        self.server.Stop()
+
+    def testKeepsOrder(self):
+        urls = ['/V1/GET/%d/' % i for i in range(30)]
+        seen = []
+        feeds = self.crouke._FanOut(urls, lambda i, f: seen.append(i))
+        self.assertEqual([str(i) for i in range(30)],
+                         [f.data.id.text for f in feeds])
+        self.assertEqual(range(30), seen)
+
+    def testKnownFeedsAreNotRequested(self):
+        urls = ['/V1/GET/%d/' % i for i in range(4)]
+        feeds = self.crouke._FanOut(urls, known={0: 'zero', 2: 'two'})
+        self.assertEqual('zero', feeds[0])
+        self.assertEqual('two', feeds[2])
+        self.assertEqual(2, self.server.counts['requests'])
+
+    def testConvertsRetrievedFeeds(self):
+        urls = ['/V1/GET/%d/' % i for i in range(3)]
+        feeds = self.crouke._FanOut(urls, known={1: 'one'},
+                                    convert=lambda f: f.data.id.text)
+        self.assertEqual(['0', 'one', '2'], feeds)
+
+    def testFailedBatchDoesNotStopWorkers(self):
+        urls = ['/V1/GET/%d/' % i for i in range(40)]
+        self.crouke._client = _FailingClient(urls[9])
+        feeds = self.crouke._FanOut(urls)
+        batch = presentation._FANOUT_BATCH
+        failed = range(9 // batch * batch, 9 // batch * batch + batch)
+        for i, feed in enumerate(feeds):
+            if i in failed:
+                self.assertEqual(None, feed)
+            else:
+                self.assertEqual(urls[i], feed)
+
+
+def _Ids(newest, oldest):
+    """Return the content ids from newest down to, not including, oldest."""
+    return [str(i) for i in xrange(newest, oldest, -1)]
+
+
+class _StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = localserver.LocalServer()
+        self.server.Start()
+        self.tmp = tempfile.mkdtemp()
+        self.crouke = presentation.Crouke()
+        self.crouke._client = client.CroukeClient()
+        self.crouke._client.RegisterHandlers('Get', client.DefaultCRUDHandler(
+                                             server=self.server.address))
+        self.crouke._store = presentation.store.ContentStore(
+            os.path.join(self.tmp, 'store.db'))
+
+    def tearDown(self):
+        self.crouke._store.Close()
+        client.GetConnectionPool(self.server.address).Close()
+        self.server.Stop()
+        shutil.rmtree(self.tmp)
+
+
+class GetListingTest(_StoreTest):
+
+    def testStoredPageIsNotRequested(self):
+        first = self.crouke.GetListing(['1']).GetIds()
+        self.assertEqual(first, self.crouke.GetListing(['1']).GetIds())
+        self.assertEqual(1, self.server.counts['requests'])
+
+    def testStalePageWhenListFails(self):
+        uri = self.crouke._ListUri(['1'], 'new', 0)
+        self.crouke._Store('list', [(uri, [('7', '1', 'a', '0', '0')], 1)],
+                           0.05)
+        time.sleep(0.1)
+        self.server.fail.add(uri)
+        self.assertEqual(['7'], self.crouke.GetListing(['1']).GetIds())
+
+
+class SyncTest(_StoreTest):
+
+    def testFirstSyncSetsMark(self):
+        self.server.newest = 59
+        self.assertEqual(_Ids(59, 19), self.crouke.Sync(['1'], 2))
+        self.assertEqual(59, self.crouke._Stored('mark', '1'))
+
+    def testMaxPagesKeepsMark(self):
+        self.server.newest = 59
+        self.crouke.Sync(['1'], 1)
+        self.server.newest = 119
+        self.assertEqual(_Ids(119, 79), self.crouke.Sync(['1'], 2))
+        self.assertEqual(59, self.crouke._Stored('mark', '1'))
+        self.assertEqual(_Ids(79, 59), self.crouke.Sync(['1'], 5))
+        self.assertEqual(119, self.crouke._Stored('mark', '1'))
+
+    def testFailedPageKeepsMark(self):
+        self.server.newest = 59
+        self.crouke.Sync(['1'], 1)
+        self.server.newest = 99
+        self.server.fail.add(self.crouke._ListUri(['1'], 'new', 1))
+        self.assertEqual(_Ids(99, 79), self.crouke.Sync(['1'], 5))
+        self.assertEqual(59, self.crouke._Stored('mark', '1'))
+        self.server.fail.clear()
+        self.assertEqual(_Ids(79, 59), self.crouke.Sync(['1'], 5))
+        self.assertEqual(99, self.crouke._Stored('mark', '1'))
+
+    def testListEndAdvancesMark(self):
+        self.server.newest = 9
+        self.crouke.Sync(['1'], 1)
+        self.server.newest = 29
+        self.assertEqual(_Ids(29, 9), self.crouke.Sync(['1'], 5))
+        self.assertEqual(29, self.crouke._Stored('mark', '1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
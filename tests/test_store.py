@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Test the local SQLite store.
+"""
+
+# System library
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Crouke library
+# localserver puts the repo root on sys.path.
+import localserver
+from backend import store
+
+
+class ContentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = store.ContentStore(os.path.join(self.tmp, 'store.db'))
+
+    def tearDown(self):
+        self.store.Close()
+        shutil.rmtree(self.tmp)
+
+    def testPutAndGet(self):
+        self.store.Put('content', 'site', '1', {'id': '1'}, 60, 100)
+        self.assertEqual({'id': '1'}, self.store.Get('content', 'site', '1'))
+        self.assertEqual(None, self.store.Get('content', 'other', '1'))
+        self.assertEqual(100, self.store.GetInfo('content', 'site', '1')[0])
+
+    def testExpiredRecordIsStale(self):
+        self.store.Put('list', 'site', 'uri', ['entry'], 0.05)
+        time.sleep(0.1)
+        self.assertEqual(None, self.store.Get('list', 'site', 'uri'))
+        self.assertEqual(['entry'],
+                         self.store.Get('list', 'site', 'uri', stale=True))
+
+    def testNegativeTtlNeverExpires(self):
+        self.store.Put('mark', 'site', '1', 100, -1)
+        self.assertEqual(None, self.store.GetInfo('mark', 'site', '1')[2])
+        self.assertEqual(0, self.store.Purge(time.time() + 86400))
+        self.assertEqual(100, self.store.Get('mark', 'site', '1'))
+
+    def testZeroTtlStoresNothing(self):
+        self.store.Put('content', 'site', '1', {}, 0)
+        self.assertEqual(None, self.store.GetInfo('content', 'site', '1'))
+
+    def testTouchRenewsRecord(self):
+        self.store.Put('content', 'site', '1', {'id': '1'}, 0.05)
+        time.sleep(0.1)
+        self.store.Touch('content', 'site', ['1', '2'], 60)
+        self.assertEqual({'id': '1'}, self.store.Get('content', 'site', '1'))
+        self.assertEqual(None, self.store.GetInfo('content', 'site', '2'))
+
+    def testPurgeDeletesExpiredRecords(self):
+        self.store.Put('content', 'site', '1', {}, 0.05)
+        self.store.Put('content', 'site', '2', {}, 60)
+        time.sleep(0.1)
+        self.assertEqual(1, self.store.Purge())
+        self.assertEqual(None, self.store.Get('content', 'site', '1',
+                                              stale=True))
+        self.assertEqual({}, self.store.Get('content', 'site', '2'))
+
+    def testGetChanged(self):
+        self.assertEqual(100, store.GetChanged('100'))
+        self.assertEqual(None, store.GetChanged('soon'))
+        self.assertEqual(None, store.GetChanged(None))
+
+
+if __name__ == '__main__':
+    unittest.main()